@@ -0,0 +1,1498 @@
+import argparse, base64, hashlib, os, sys, tempfile, time, tracemalloc
+import xml.etree.ElementTree as ET
+
+from fb2_html import HtmlConverter
+from fb2_parser import FB2Stream
+
+WORDS = ("книга глава текст страница чтение автор герой дорога город ночь "
+         "the reader page story river light window letter morning").split()
+
+
+def make_book(path, paragraphs=20000, sections=200, images=40, image_kb=512, nested=False, image=None,
+              inline=False):
+    # Синтетическая FB2-книга: текст, разбитый на секции, и набор <binary>;
+    # image — настоящая картинка вместо случайных байтов, inline — картинка
+    # в начале каждой секции
+    seed = 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" '
+                'xmlns:l="http://www.w3.org/1999/xlink">\n<description><title-info>'
+                '<genre>prose</genre><author><first-name>Test</first-name><last-name>Author</last-name></author>'
+                '<book-title>Synthetic Book</book-title><lang>ru</lang>'
+                '<coverpage><image l:href="#img0"/></coverpage></title-info></description>\n<body>\n')
+        per_section = max(1, paragraphs // sections)
+        for s in range(sections):
+            f.write(f"<section><title><p>Глава {s + 1}</p></title>\n")
+            if inline and images:
+                f.write(f'<image l:href="#img{s % images}"/>\n')
+            if nested:
+                f.write(f"<section><title><p>Часть {s + 1}.1</p></title>\n")
+            for _ in range(per_section):
+                words = []
+                for _ in range(60):
+                    seed = (seed * 1103515245 + 12345) & 0x7fffffff
+                    words.append(WORDS[seed % len(WORDS)])
+                f.write(f"<p>{' '.join(words)}.</p>\n")
+            if nested:
+                f.write("</section>\n")
+            f.write("</section>\n")
+        f.write("</body>\n")
+        blob = base64.encodebytes(image or os.urandom(image_kb * 1024)).decode("ascii")
+        for i in range(images):
+            f.write(f'<binary id="img{i}" content-type="image/jpeg">{blob}</binary>\n')
+        f.write("</FictionBook>\n")
+    return path
+
+
+def make_image(width, height, fmt="JPG"):
+    # Градиент, а не заливка: иначе JPEG сжимается до пары килобайт
+    from PySide6.QtGui import QImage, QPainter, QLinearGradient, QColor
+    from PySide6.QtCore import QBuffer
+    image = QImage(width, height, QImage.Format_RGB32)
+    painter = QPainter(image)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(40, 60, 140))
+    gradient.setColorAt(1, QColor(220, 180, 60))
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    buffer = QBuffer()
+    buffer.open(QBuffer.WriteOnly)
+    image.save(buffer, fmt)
+    return bytes(buffer.data())
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def make_window(state_db=":memory:"):
+    # Окно без кэша книг и со своей базой состояния: сохранённые прошлым
+    # запуском шрифт, режим и позиция не должны менять замер
+    from fb2_reader import FB2Reader
+    from reading_state import ReadingState
+    window = FB2Reader()
+    window.book_cache = None
+    window.reading_state = ReadingState(state_db)
+    return window
+
+
+class StallTicker:
+    # Таймер цикла событий раз в 5 мс: промежутки между тиками — задержки GUI-потока
+    def __init__(self, on_tick=None):
+        from PySide6.QtCore import QTimer
+        self.gaps = []
+        self.on_tick = on_tick
+        self._last = 0
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._tick)
+
+    def _tick(self):
+        now = time.perf_counter()
+        self.gaps.append(now - self._last)
+        self._last = now
+        if self.on_tick is not None:
+            self.on_tick()
+
+    def start(self):
+        self._last = time.perf_counter()
+        self._timer.start(5)
+
+    def stop(self):
+        self._timer.stop()
+
+
+def parse_etree(path):
+    # Прежний путь load_fb2: всё дерево + словарь base64-строк
+    ns = {'fb2': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
+    root = ET.parse(path).getroot()
+    binaries = {b.attrib["id"]: b.text.strip() for b in root.findall("fb2:binary", ns) if b.text}
+    count = sum(1 for _ in root.iter("{http://www.gribuser.ru/xml/fictionbook/2.0}p"))
+    return count, len(binaries)
+
+
+def parse_stream(path):
+    stream = FB2Stream(path)
+    count = sum(1 for event in stream if event[0] == "start" and event[1] == "p")
+    return count, len(stream.binaries)
+
+
+def bench_parse(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=args.images,
+                         image_kb=args.image_kb)
+        size = os.path.getsize(path) / 2**20
+        print(f"book: {size:.1f} MB, {args.paragraphs} paragraphs, {args.images} images")
+        for name, func in (("etree", parse_etree), ("stream", parse_stream)):
+            elapsed, peak, result = measure(func, path)
+            print(f"{name:>8}: {elapsed:6.2f} s, peak {peak / 2**20:7.1f} MB, result {result}")
+
+
+def synthetic_events(paragraphs, per_section=100):
+    events = [("start", "FictionBook", {}), ("start", "body", {})]
+    for i in range(paragraphs):
+        if i % per_section == 0:
+            if i:
+                events.append(("end", "section"))
+            events += [("start", "section", {}), ("start", "title", {}), ("start", "p", {}),
+                       ("text", f"Глава {i // per_section + 1}"), ("end", "p"), ("end", "title")]
+        events += [("start", "p", {}), ("text", "Текст абзаца с <разметкой> и "),
+                   ("start", "emphasis", {}), ("text", "курсивом"), ("end", "emphasis"),
+                   ("text", " и хвостом " * 20), ("end", "p")]
+    events += [("end", "section"), ("end", "body"), ("end", "FictionBook")]
+    return events
+
+
+def concat_html(events):
+    # Прежний способ сборки: html += f"..." на каждый абзац
+    html = ""
+    text = None
+    for event in events:
+        if event[0] == "start" and event[1] == "p":
+            text = []
+        elif event[0] == "text" and text is not None:
+            text.append(event[1])
+        elif event[0] == "end" and event[1] == "p":
+            html += f"<p>{''.join(text)}</p>"
+            text = None
+    return html
+
+
+def bench_convert(args):
+    rows = []
+    n = args.paragraphs
+    for _ in range(args.steps):
+        events = synthetic_events(n)
+        timings = []
+        for func in (lambda: HtmlConverter().convert(events), lambda: concat_html(events)):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        rows.append((n, *timings))
+        n *= 2
+    print(f"{'paragraphs':>10} {'converter':>10} {'us/para':>8} {'html +=':>10} {'us/para':>8}")
+    for n, conv, concat in rows:
+        print(f"{n:>10} {conv:>9.3f}s {conv / n * 1e6:>8.2f} {concat:>9.3f}s {concat / n * 1e6:>8.2f}")
+    per_para = [conv / n for n, conv, _ in rows]
+    ratio = max(per_para) / min(per_para)
+    print(f"converter cost per paragraph varies {ratio:.2f}x across sizes")
+    if ratio > args.max_ratio:
+        sys.exit(f"converter does not scale linearly: {ratio:.2f}x > {args.max_ratio}x")
+
+
+def bench_cache(args):
+    from book_cache import BookCache, load_book
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=args.images)
+        cache = BookCache(os.path.join(tmp, "cache"))
+        print(f"book: {os.path.getsize(path) / 2**20:.1f} MB")
+        for label in ("cold", "warm", "warm"):
+            start = time.perf_counter()
+            load_book(path, cache)
+            print(f"{label}: {(time.perf_counter() - start) * 1000:8.1f} ms")
+        print(cache.stats())
+
+
+def bench_load(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QEventLoop
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=args.images)
+        print(f"book: {os.path.getsize(path) / 2**20:.1f} MB")
+        window = make_window()
+        window.content.progressive = False
+        window.show()
+
+        # Пока книга грузится в пуле потоков, таймер цикла событий должен тикать
+        loop = QEventLoop()
+
+        def loaded():
+            if window.load_task is None:
+                loop.quit()
+
+        ticker = StallTicker(loaded)
+        start = time.perf_counter()
+        window.load_fb2(path)
+        ticker.start()
+        loop.exec()
+        ticker.stop()
+        if window.book_document is None:
+            sys.exit("the book did not load")
+        # Последний тик включает setHtml в GUI-потоке — его считаем отдельно
+        loading = ticker.gaps[:-1]
+        print(f"loaded in {(time.perf_counter() - start) * 1000:.1f} ms, {len(loading)} event-loop ticks "
+              f"while loading, longest stall {max(loading, default=0) * 1000:.1f} ms")
+        if max(loading, default=0) * 1000 > args.max_stall:
+            sys.exit(f"event loop stalled for more than {args.max_stall} ms while loading")
+
+
+def atom_feed(entries, next_href=None):
+    links = f'<link rel="next" href="{next_href}" type="application/atom+xml"/>' if next_href else ""
+    body = "".join(f"<entry><title>{title}</title>{link}</entry>" for title, link in entries)
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            f'<feed xmlns="http://www.w3.org/2005/Atom"><title>Fixture</title>{links}{body}</feed>').encode("utf-8")
+
+
+class FixtureOPDS:
+    # Локальный OPDS-сервер: /opds со списком подкаталогов, /cat/N?page=K с книгами
+    # и ссылкой rel="next", /book/N.fb2 с небольшой книгой
+
+    def __init__(self, catalogs=20, pages=3, books=25, delay=0.0, cache_control=None):
+        import threading
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+
+        fixture = self
+        self.catalogs, self.pages, self.books, self.delay = catalogs, pages, books, delay
+        self.cache_control = cache_control
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.connections = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = 64 * 1024  # заголовки и тело одним пакетом, без задержки ACK
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fixture.requests += 1
+                fixture.connections.add(self.client_address)
+                fixture.active += 1
+                fixture.peak_active = max(fixture.peak_active, fixture.active)
+                try:
+                    self.serve()
+                finally:
+                    fixture.active -= 1
+
+            def serve(self):
+                if fixture.delay:
+                    time.sleep(fixture.delay)
+                url = urlparse(self.path)
+                body, ctype = fixture.route(url.path, parse_qs(url.query))
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    fixture.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                start = 0
+                ranged = self.headers.get("Range", "")
+                if self.headers.get("If-Range", etag) != etag:
+                    # Файл сменился: Range не действует, отдаём целиком
+                    ranged = ""
+                if ranged.startswith("bytes=") and ranged.endswith("-"):
+                    start = int(ranged[6:-1])
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                    body = body[start:]
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                if fixture.cache_control is not None:
+                    self.send_header("Cache-Control", fixture.cache_control)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # Клиент оборвал закачку — так и задумано в проверке докачки
+                    return
+                fixture.bytes_sent += len(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def route(self, path, query):
+        if path == "/opds":
+            entries = [(f"Catalog {i}", f'<link href="/cat/{i}" type="application/atom+xml"/>')
+                       for i in range(self.catalogs)]
+            return atom_feed(entries), "application/atom+xml"
+        if path.startswith("/cat/"):
+            cat = int(path.rsplit("/", 1)[1])
+            page = int(query.get("page", ["0"])[0])
+            entries = [(f"Book {cat}.{page}.{i}",
+                        f'<link href="/book/{cat}_{page}_{i}.fb2" type="application/fb2"/>')
+                       for i in range(self.books)]
+            next_href = f"/cat/{cat}?page={page + 1}" if page + 1 < self.pages else None
+            return atom_feed(entries, next_href), "application/atom+xml"
+        if path.startswith("/book/"):
+            return self.book_bytes(), "application/fb2"
+        return None, None
+
+    def book_bytes(self):
+        if getattr(self, "_book", None) is None:
+            with tempfile.TemporaryDirectory() as tmp:
+                with open(make_book(os.path.join(tmp, "b.fb2"), 200, sections=5, images=1, image_kb=16), "rb") as f:
+                    self._book = f.read()
+        return self._book
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_opds(args):
+    import requests
+    from opds_client import OPDSClient
+
+    server = FixtureOPDS(catalogs=args.pages, delay=args.delay)
+    urls = [f"{server.url}/cat/{i}" for i in range(args.pages)]
+    try:
+        rows = []
+        start = time.perf_counter()
+        for url in urls:
+            requests.get(url).content
+        rows.append(("requests.get", time.perf_counter() - start, len(server.connections)))
+
+        client = OPDSClient()
+        server.connections.clear()
+        start = time.perf_counter()
+        for url in urls:
+            client.fetch_feed(url)
+        rows.append(("pooled session", time.perf_counter() - start, len(server.connections)))
+
+        server.connections.clear()
+        start = time.perf_counter()
+        feeds = client.fetch_many(urls)
+        rows.append(("pooled concurrent", time.perf_counter() - start, len(server.connections)))
+        client.close()
+    finally:
+        server.close()
+    assert all(len(feed.books) == server.books and feed.next_url for feed in feeds)
+    print(f"{args.pages} feed pages from {server.url}, {args.delay * 1000:.0f} ms server delay")
+    for name, elapsed, conns in rows:
+        print(f"{name:>18}: {elapsed * 1000:8.1f} ms, {conns} TCP connections")
+
+
+def bench_feedcache(args):
+    from feed_cache import FeedCache
+    from opds_client import OPDSClient
+
+    errors = []
+    # Типичный просмотр: корень -> подкаталог -> назад -> следующий подкаталог ...
+    for control in (None, "max-age=0", "no-store"):
+        server = FixtureOPDS(catalogs=args.catalogs, delay=args.delay, cache_control=control)
+        path = [f"{server.url}/opds"]
+        for i in range(args.catalogs):
+            path += [f"{server.url}/cat/{i}", f"{server.url}/opds"]
+        with tempfile.TemporaryDirectory() as tmp:
+            results = []
+            for label, cache in (("no cache", None), ("cold cache", FeedCache(tmp)), ("warm disk", FeedCache(tmp))):
+                client = OPDSClient(feed_cache=cache)
+                server.bytes_sent = 0
+                server.not_modified = 0
+                start = time.perf_counter()
+                for url in path:
+                    client.fetch_feed(url)
+                results.append((label, time.perf_counter() - start, server.bytes_sent, server.not_modified, cache))
+                client.close()
+            stored = [name for name in os.listdir(tmp) if not name.endswith(".tmp")]
+        server.close()
+        print(f"{len(path)} feed views, Cache-Control: {control or 'none (default TTL)'}")
+        for label, elapsed, sent, not_modified, cache in results:
+            stats = cache.stats() if cache else {}
+            print(f"  {label:>10}: {elapsed * 1000:8.1f} ms, {sent / 1024:8.1f} KB over the wire"
+                  + (f", hit ratio {stats['hit_ratio']:.2f}, saved {stats['bytes_saved'] / 1024:.1f} KB,"
+                     f" 304s {not_modified}" if stats else ""))
+        _, _, sent, not_modified, _ = results[-1]
+        if control is None and sent:
+            errors.append(f"warm disk cache sent {sent} bytes with fresh entries")
+        if control == "max-age=0" and not_modified != len(path):
+            errors.append(f"max-age=0: {not_modified} of {len(path)} views revalidated with 304")
+        if control == "no-store" and stored:
+            errors.append(f"no-store: {len(stored)} files written to the cache")
+
+    # Каталог кэша недоступен для записи: ленты всё равно должны открываться
+    server = FixtureOPDS(catalogs=args.catalogs)
+    with tempfile.NamedTemporaryFile() as blocker:
+        cache = FeedCache(os.path.join(blocker.name, "feeds"))
+        client = OPDSClient(feed_cache=cache)
+        try:
+            for url in (f"{server.url}/opds", f"{server.url}/cat/0"):
+                client.fetch_feed(url)
+        except Exception as e:
+            errors.append(f"fetch failed with an unwritable cache: {type(e).__name__}: {e}")
+        finally:
+            client.close()
+            server.close()
+        print(f"unwritable cache directory: {cache.stats()['write_errors']} write errors, feeds still fetched")
+    if errors:
+        sys.exit("; ".join(errors))
+
+
+def bench_download(args):
+    import io, zipfile
+    import requests
+    from fb2_html import convert
+    from opds_client import OPDSClient
+
+    server = FixtureOPDS()
+    with tempfile.TemporaryDirectory() as tmp:
+        book = make_book(os.path.join(tmp, "src.fb2"), args.paragraphs, images=args.images)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.write(book, "book.fb2")
+        server._book = buffer.getvalue()
+        os.unlink(book)
+        url = f"{server.url}/book/1.fb2.zip"
+        print(f"archive {len(server._book) / 2**20:.1f} MB, book {args.paragraphs} paragraphs, {args.images} images")
+
+        def old_path():
+            # Как было: всё тело ответа в памяти, запись, распаковка .fb2 рядом, разбор
+            path = os.path.join(tmp, "old.fb2.zip")
+            with open(path, "wb") as f:
+                f.write(requests.get(url).content)
+            with zipfile.ZipFile(path) as archive:
+                extracted = archive.extract("book.fb2", os.path.join(tmp, "old"))
+            convert(extracted)
+            return os.path.getsize(path) + os.path.getsize(extracted)
+
+        def new_path():
+            path = OPDSClient().download(url, os.path.join(tmp, "new.fb2.zip"))
+            convert(path)
+            return os.path.getsize(path)
+
+        for name, func in (("buffer+extract", old_path), ("stream", new_path)):
+            elapsed, peak, written = measure(func)
+            print(f"{name:>15}: {elapsed:6.2f} s, peak {peak / 2**20:7.1f} MB, {written / 2**20:6.1f} MB on disk")
+
+        from opds_client import DownloadCancelled
+        client = OPDSClient()
+        errors = []
+
+        def interrupted(dest):
+            # Обрыв на середине: остаются .part и валидатор первого ответа
+            try:
+                client.download(url, dest, progress=lambda done, total: None,
+                                cancelled=lambda: os.path.exists(dest + ".part")
+                                and os.path.getsize(dest + ".part") >= len(server._book) // 2)
+            except DownloadCancelled:
+                pass
+
+        def check(name, dest, expected):
+            server.bytes_sent = 0
+            client.download(url, dest)
+            with open(dest, "rb") as f:
+                intact = f.read() == expected
+            leftovers = [p for p in (dest + ".part", dest + ".part.json") if os.path.exists(p)]
+            print(f"{name:>15}: fetched {server.bytes_sent / 2**20:5.1f} MB of {len(expected) / 2**20:.1f} MB, "
+                  f"intact: {intact}{', left ' + ', '.join(leftovers) if leftovers else ''}")
+            if not intact or leftovers:
+                errors.append(f"{name}: downloaded file is corrupt or temporary files were left")
+
+        dest = os.path.join(tmp, "resume.fb2.zip")
+        interrupted(dest)
+        check("resume", dest, server._book)
+
+        # Файл на сервере сменился между попытками: склейки старого и нового быть не должно
+        dest = os.path.join(tmp, "changed.fb2.zip")
+        interrupted(dest)
+        old = server._book
+        server._book = old[::-1]
+        check("changed", dest, server._book)
+        server._book = old
+
+        # Всё уже скачано (416) и .part длиннее файла на сервере (416 с другим размером)
+        for name, extra in (("complete", b""), ("oversized", b"junk")):
+            dest = os.path.join(tmp, name + ".fb2.zip")
+            interrupted(dest)
+            with open(dest + ".part", "wb") as f:
+                f.write(server._book + extra)
+            check(name, dest, server._book)
+        client.close()
+    server.close()
+    if errors:
+        sys.exit("; ".join(errors))
+
+
+def bench_queue(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtCore import QCoreApplication
+    from download_manager import DownloadManager
+    from opds_client import OPDSClient
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    server = FixtureOPDS(delay=args.delay)
+    client = OPDSClient(pool_size=8)
+    try:
+        for workers, per_host in ((1, 1), (4, 2), (4, 4)):
+            with tempfile.TemporaryDirectory() as tmp:
+                manager = DownloadManager(tmp, max_workers=workers, per_host=per_host, client=client)
+                server.peak_active = 0
+                start = time.perf_counter()
+                for i in range(args.books):
+                    manager.enqueue(f"Book {i}", f"{server.url}/book/{i}.fb2")
+                while manager.pending():
+                    app.processEvents()
+                    time.sleep(0.001)
+                elapsed = time.perf_counter() - start
+                ok = sum(1 for job in manager.jobs if job.state == "done")
+                print(f"workers={workers} per_host={per_host}: {args.books} books in {elapsed * 1000:7.1f} ms, "
+                      f"{ok} done, peak {server.peak_active} concurrent requests on the host")
+
+        # Очередь к одному хосту не должна задерживать книгу с другого:
+        # localhost и 127.0.0.1 для менеджера — разные хосты
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = DownloadManager(tmp, max_workers=4, per_host=2, client=client)
+            for i in range(args.books):
+                manager.enqueue(f"Busy {i}", f"{server.url}/book/{i}.fb2")
+            start = time.perf_counter()
+            other = manager.enqueue("Other host", server.url.replace("127.0.0.1", "localhost") + "/book/0.fb2")
+            while other.state not in ("done", "failed"):
+                app.processEvents()
+                time.sleep(0.001)
+            other_ms = (time.perf_counter() - start) * 1000
+            while manager.pending():
+                app.processEvents()
+                time.sleep(0.001)
+            print(f"other host behind {args.books} queued books: done in {other_ms:.1f} ms")
+            if other.state != "done" or other_ms > args.delay * 1000 * args.books / 4:
+                sys.exit("a job for another host waited for the busy host's queue")
+
+        # Предзагрузка следующей страницы, пока пользователь смотрит текущую
+        page = client.fetch_feed(f"{server.url}/cat/0")
+        start = time.perf_counter()
+        client.fetch_feed(f"{server.url}/cat/1?page=1")
+        cold = time.perf_counter() - start
+        client.prefetch_feed(page.next_url)
+        time.sleep(args.delay * 3)
+        start = time.perf_counter()
+        client.feed_future(page.next_url).result()
+        warm = time.perf_counter() - start
+        print(f"next page: {cold * 1000:.1f} ms on click, {warm * 1000:.1f} ms when prefetched")
+    finally:
+        client.close()
+        server.close()
+
+
+def bench_library(args):
+    import shutil, zipfile
+    from library import Library
+    from library_dialog import make_thumbnail
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "books")
+        os.makedirs(folder)
+        sample = make_book(os.path.join(tmp, "sample.fb2"), args.paragraphs, sections=10, images=1,
+                           image=make_image(600, 900))
+        with open(sample, encoding="utf-8") as f:
+            template = f.read()
+        for i in range(args.books):
+            text = template.replace("Synthetic Book", f"Книга номер {i}").replace(
+                "<last-name>Author", f"<last-name>Автор{i % 97}")
+            sub = os.path.join(folder, f"{i % 50:02d}")
+            os.makedirs(sub, exist_ok=True)
+            path = os.path.join(sub, f"book{i}.fb2")
+            if i % 5 == 0:
+                with zipfile.ZipFile(path + ".zip", "w", zipfile.ZIP_DEFLATED) as archive:
+                    archive.writestr(f"book{i}.fb2", text)
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+        size = sum(os.path.getsize(os.path.join(r, n)) for r, _, files in os.walk(folder) for n in files)
+        print(f"{args.books} books, {size / 2**20:.1f} MB")
+
+        library = Library(os.path.join(tmp, "library.sqlite"))
+        library.add_folder(folder)
+        for label in ("cold scan", "rescan (unchanged)"):
+            start = time.perf_counter()
+            result = library.scan(workers=args.workers)
+            print(f"{label:>20}: {(time.perf_counter() - start) * 1000:8.1f} ms {result}")
+            # Обложки тем же путём, что и в окне библиотеки: отдельный проход с миниатюрами
+            start = time.perf_counter()
+            covers = library.fill_covers(make_thumbnail, workers=args.workers)
+            print(f"{'covers':>20}: {(time.perf_counter() - start) * 1000:8.1f} ms, {covers} read")
+        for root, _, files in list(os.walk(folder))[:3]:
+            for name in files[:5]:
+                os.utime(os.path.join(root, name))
+        shutil.rmtree(os.path.join(folder, "49"))
+        try:
+            # Битая ссылка не должна обрывать сканирование всей папки
+            os.symlink(os.path.join(tmp, "gone.fb2"), os.path.join(folder, "broken.fb2"))
+        except (OSError, NotImplementedError):
+            pass
+        start = time.perf_counter()
+        result = library.scan(workers=args.workers)
+        print(f"{'rescan (touched)':>20}: {(time.perf_counter() - start) * 1000:8.1f} ms {result}")
+        start = time.perf_counter()
+        covers = library.fill_covers(make_thumbnail, workers=args.workers)
+        print(f"{'covers':>20}: {(time.perf_counter() - start) * 1000:8.1f} ms, {covers} read")
+        missing = library.db.execute(
+            "SELECT COUNT(*) FROM books WHERE cover IS NULL OR length(cover) = 0").fetchone()[0]
+        if missing:
+            sys.exit(f"{missing} books have no cover thumbnail")
+        for query in ("книга 123", "автор1", "prose", ""):
+            start = time.perf_counter()
+            rows = library.search(query)
+            print(f"search {query!r:>12}: {len(rows):4} hits in {(time.perf_counter() - start) * 1000:6.2f} ms")
+        library.close()
+
+
+def bench_search(args):
+    import json, re
+    from book_cache import BookCache, load_book
+    from book_search import BookIndex, snippet
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=0)
+        cache = BookCache(os.path.join(tmp, "cache"))
+        texts = load_book(path)["document"].texts
+        print(f"book: {len(texts)} paragraphs")
+
+        start = time.perf_counter()
+        index = BookIndex().build(texts)
+        print(f"build index: {(time.perf_counter() - start) * 1000:8.1f} ms, {len(index.postings)} terms")
+        start = time.perf_counter()
+        cache.put(path, index.to_json(), "index")
+        stored = time.perf_counter() - start
+        start = time.perf_counter()
+        index = BookIndex.from_json(cache.get(path, "index"))
+        print(f"cache store: {stored * 1000:8.1f} ms, load {(time.perf_counter() - start) * 1000:.1f} ms, "
+              f"{len(json.dumps(index.to_json(), ensure_ascii=False).encode()) / 2**20:.1f} MB")
+
+        # Поиск по мере ввода: каждый префикс запроса, как при наборе
+        for query in ("дорогами", "ночь город", "Городу НОЧИ"):
+            typed = [query[:n] for n in range(3, len(query) + 1)]
+            start = time.perf_counter()
+            for prefix in typed:
+                hits = index.search(prefix)
+            indexed = (time.perf_counter() - start) / len(typed)
+            start = time.perf_counter()
+            snippets = [snippet(texts[i], query) for i in hits[:50]]
+            shown = time.perf_counter() - start
+            # Для сравнения: поиск подстроки по всему тексту без индекса
+            pattern = re.compile(re.escape(query.split()[0]), re.IGNORECASE)
+            start = time.perf_counter()
+            scanned = sum(1 for text in texts if pattern.search(text))
+            naive = time.perf_counter() - start
+            print(f"{query!r:>16}: {len(hits):5} hits, index {indexed * 1000:6.2f} ms per keystroke, "
+                  f"50 snippets {shown * 1000:5.1f} ms, linear scan {naive * 1000:6.1f} ms ({scanned} hits)")
+            if not snippets:
+                sys.exit(f"no hits for {query!r}")
+
+
+def rss_mb():
+    # Текущий (не пиковый) RSS процесса, Linux
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def bench_pages(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        for paragraphs in args.paragraphs:
+            path = make_book(os.path.join(tmp, f"book{paragraphs}.fb2"), paragraphs, images=0)
+            for page_mode in (False, True):
+                # Своя база в памяти: сохранённое состояние не должно менять режим замера
+                window = make_window()
+                window.page_mode_action.setChecked(page_mode)
+                window.show()
+                app.processEvents()
+                before = rss_mb()
+                window.load_fb2(path)
+                while window.load_task is not None:
+                    app.processEvents()
+                window.content.finish_rendering()
+                view = window.current_view()
+                view.jump_to_part(paragraphs // 2)
+                app.processEvents()
+                loaded = rss_mb() - before
+                # Масштаб туда и обратно: время до готовой раскладки текущего места
+                start = time.perf_counter()
+                for delta in (2, -2):
+                    window.adjust_font_size(delta)
+                    view.current_part()
+                    view.repaint()
+                zoom = (time.perf_counter() - start) / 2
+                start = time.perf_counter()
+                window.apply_theme("sepia")
+                view.repaint()
+                theme = time.perf_counter() - start
+                print(f"{paragraphs:>7} paragraphs, {'pages ' if page_mode else 'scroll'}: "
+                      f"+{loaded:6.1f} MB RSS, zoom {zoom * 1000:8.1f} ms, theme {theme * 1000:8.1f} ms, "
+                      f"at {window.progress.text()}")
+                window.close_book()
+                window.close()
+                window.deleteLater()
+                app.processEvents()
+
+
+def retained(build):
+    # Сколько памяти остаётся занято построенным объектом (не пик во время сборки)
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def bench_model(args):
+    import json, random
+    from doc_model import Document
+    from fb2_html import convert, render
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=args.images, image_kb=256)
+        print(f"book: {os.path.getsize(path) / 2**20:.1f} MB, {args.paragraphs} paragraphs, {args.images} images")
+
+        # ElementTree держит и base64 картинок; модель хранит только их смещения в файле
+        tree_size, tree = retained(lambda: ET.parse(path))
+        del tree
+        parts_size, parts = retained(lambda: convert(path)[0].parts)
+        del parts
+        model_size, converter = retained(lambda: convert(path)[0])
+        document = converter.document
+        blob = json.dumps(document.to_json(), ensure_ascii=False)
+        loaded_size, loaded = retained(lambda: Document.from_json(json.loads(blob)))
+        del loaded
+        for name, size in (("ElementTree", tree_size), ("HTML parts", parts_size),
+                           ("Document", model_size), ("Document from cache", loaded_size)):
+            print(f"{name:>20}: {size / 2**20:7.1f} MB")
+
+        # Случайный доступ: HTML для произвольного окна абзацев
+        random.seed(1)
+        starts = [random.randrange(len(document)) for _ in range(200)]
+        start = time.perf_counter()
+        for first in starts:
+            render(document, first, first + args.window)
+        elapsed = (time.perf_counter() - start) / len(starts)
+        print(f"render {args.window} paragraphs at random offsets: {elapsed * 1000:.2f} ms")
+        start = time.perf_counter()
+        for first in starts:
+            document[first]
+        print(f"paragraph by index: {(time.perf_counter() - start) / len(starts) * 1e6:.1f} us")
+
+
+def make_nested_book(path, depth, fanout, paragraphs):
+    # Цепочка из depth вложенных секций, на каждом уровне ещё fanout соседних листьев
+    expected = []
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" '
+                'xmlns:l="http://www.w3.org/1999/xlink">\n'
+                '<description><title-info><book-title>Nested</book-title></title-info></description>\n<body>\n')
+        # Пустые стили и ссылки: блоков в виджете должно быть ровно столько же, сколько абзацев
+        text = ("<p>" + " ".join(WORDS) + "</p>\n<p>a<emphasis/>b</p>\n<p><a l:href=\"#n2\"/></p>\n"
+                "<p><strong></strong></p>\n<p><emphasis> </emphasis></p>\n")
+        for level in range(1, depth + 1):
+            f.write(f"<section><title><p>Раздел {level}</p></title>\n")
+            expected.append((f"Раздел {level}", level))
+            for leaf in range(fanout):
+                f.write(f"<section><title><p>Раздел {level}.{leaf + 1}</p></title>\n{text * paragraphs}</section>\n")
+                expected.append((f"Раздел {level}.{leaf + 1}", level + 1))
+        f.write("</section>\n" * depth + "</body>\n")
+        # Примечания должны уйти одним пунктом в конец оглавления, а не россыпью номеров
+        f.write('<body name="notes"><title><p>Примечания</p></title>\n')
+        expected.append(("Примечания", 1))
+        for note in range(1, fanout + 1):
+            f.write(f'<section id="n{note}"><title><p>{note}</p></title><p>Примечание {note}</p></section>\n')
+            expected.append((str(note), 2))
+        f.write("</body>\n</FictionBook>\n")
+    return expected
+
+
+def bench_toc(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from fb2_html import convert
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nested.fb2")
+        expected = make_nested_book(path, args.depth, args.fanout, args.paragraphs)
+        document = convert(path)[0].document
+        sections = document.sections
+
+        # Структура: заголовки, глубина, родители и вложенность диапазонов абзацев
+        errors = []
+        if [(s.title, s.depth) for s in sections] != expected:
+            errors.append("titles or depths differ from the generated book")
+        for i, section in enumerate(sections):
+            parent = sections[section.parent] if section.parent is not None else None
+            if parent is not None and not (parent.depth == section.depth - 1
+                                           and parent.start <= section.start <= section.end <= parent.end):
+                errors.append(f"section {i} is not nested in its parent")
+            if not section.title or document.texts[section.start] != section.title:
+                errors.append(f"section {i} does not start at its title")
+        top = [s.title for s in sections if s.parent is None]
+        if top != ["Раздел 1", "Примечания"]:
+            errors.append(f"top-level TOC entries {top[:5]}, expected the first chapter and the notes")
+        print(f"{len(sections)} sections, depth {max(s.depth for s in sections)}, "
+              f"{len(document)} paragraphs: {'ok' if not errors else errors[:3]}")
+
+        for page_mode in (False, True):
+            window = make_window()
+            window.page_mode_action.setChecked(page_mode)
+            window.toc_dock.show()
+            window.show()
+            start = time.perf_counter()
+            window.load_fb2(path)
+            while window.load_task is not None:
+                app.processEvents()
+            toc = window.toc_panel
+            built = time.perf_counter() - start
+            # Переход к последней секции, пока книга ещё дорисовывается
+            rendering = bool(window.content._pending)
+            target = sections[-1].start
+            jumped = []
+            view = window.current_view()
+            view.jumped.connect(lambda part: jumped.append(time.perf_counter()))
+            start = time.perf_counter()
+            toc._activate(toc._items[-1])
+            requested = time.perf_counter() - start
+            deadline = time.perf_counter() + 30
+            while not jumped and time.perf_counter() < deadline:
+                app.processEvents()
+            if not jumped:
+                sys.exit(f"{'pages' if page_mode else 'scroll'}: the jump to paragraph {target} never landed")
+            landed = view.current_part()
+            print(f"{'pages ' if page_mode else 'scroll'}: {len(toc._items)} TOC entries, loaded in "
+                  f"{built * 1000:.0f} ms, jump call {requested * 1000:.2f} ms, "
+                  f"on screen after {(jumped[0] - start) * 1000:.1f} ms"
+                  f"{' (while rendering)' if rendering else ''}, top paragraph {landed} / target {target}")
+            if page_mode:
+                # Цель должна быть на показанной странице, не обязательно первой строкой
+                view.next_page()
+                following = view.current_part()
+                ok = landed <= target < following or following == landed
+            else:
+                bar = view.verticalScrollBar()
+                ok = landed == target or bar.value() == bar.maximum()
+            if not ok:
+                errors.append(f"jump landed at {landed}, expected {target}")
+            if not page_mode:
+                window.content.finish_rendering()
+                blocks = window.content.document().blockCount()
+                if blocks != len(document):
+                    errors.append(f"{blocks} blocks in the view for {len(document)} paragraphs")
+            window.close_book()
+            window.close()
+        if errors:
+            sys.exit("; ".join(errors[:5]))
+
+
+def crash_after_save(db_path):
+    # Дочерний процесс: запись состояния и аварийный выход без закрытия базы
+    from reading_state import ReadingState
+    ReadingState(db_path).save("/books/crash.fb2", {"part": 42, "font": "Georgia", "font_size": 18,
+                                                     "theme": "sepia", "page_mode": True})
+    os._exit(1)
+
+
+def bench_state(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from multiprocessing import get_context
+    from PySide6.QtWidgets import QApplication
+    from reading_state import ReadingState
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=0)
+        db_path = os.path.join(tmp, "state.sqlite")
+
+        def open_window():
+            window = make_window(db_path)
+            window.show()
+            window.load_fb2(path)
+            while window.load_task is not None:
+                app.processEvents()
+            return window
+
+        window = open_window()
+        window.content.finish_rendering()
+        bar = window.content.verticalScrollBar()
+        # Непрерывная прокрутка: много событий valueChanged за args.seconds секунд
+        start = time.perf_counter()
+        events = 0
+        while time.perf_counter() - start < args.seconds:
+            for _ in range(50):
+                bar.setValue(bar.value() + 7)
+                events += 1
+            app.processEvents()
+        elapsed = time.perf_counter() - start
+        window.adjust_font_size(2)
+        window.apply_theme("sepia")
+        window.close_book()
+        writes = window.reading_state.writes
+        limit = int(elapsed * 1000 / window.STATE_SAVE_MS) + 2
+        saved = window.reading_state.load(path)
+        print(f"{events} scroll events in {elapsed:.1f} s -> {writes} writes (limit {limit}), saved {saved}")
+        window.close()
+
+        # Повторное открытие: позиция и настройки восстанавливаются сразу
+        start = time.perf_counter()
+        window = open_window()
+        while window.content.jump_pending():
+            app.processEvents()
+        restored = time.perf_counter() - start
+        part = window.content.current_part()
+        print(f"reopened in {restored * 1000:.0f} ms at paragraph {part}, font {window.current_font} "
+              f"{window.current_font_size}px, theme {window.current_theme}")
+        errors = []
+        if writes > limit:
+            errors.append(f"{writes} writes for {events} scroll events exceeds {limit}")
+        if part != saved["part"] or window.current_font_size != saved["font_size"] or window.current_theme != "sepia":
+            errors.append("state was not restored")
+        window.close()
+
+        # Аварийное завершение сразу после записи: состояние должно быть на месте
+        process = get_context("spawn").Process(target=crash_after_save, args=(db_path,))
+        process.start()
+        process.join()
+        state = ReadingState(db_path).load("/books/crash.fb2")
+        print(f"after crash (exit code {process.exitcode}): {state}")
+        if state is None or state["part"] != 42:
+            errors.append("state written before a crash was lost")
+        if errors:
+            sys.exit("; ".join(errors))
+
+
+# zipfile сюда не входит: его уже импортируют site и сам PySide6
+STARTUP_MODULES = ("requests", "opds", "opds_client", "sqlite3", "reading_state", "font_picker", "profiling_dialog",
+                   "multiprocessing")
+
+
+def startup_child():
+    # Отдельный процесс: холодный импорт и показ окна без открытой книги
+    start = time.perf_counter()
+    import json
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QAction, QFontDatabase
+    import fb2_reader
+    imported = time.perf_counter()
+    app = QApplication([])
+    window = fb2_reader.FB2Reader()
+    window.show()
+    app.processEvents()
+    shown = time.perf_counter()
+    result = {
+        "import_ms": (imported - start) * 1000,
+        "shown_ms": (shown - start) * 1000,
+        "actions": len(window.findChildren(QAction)),
+        "families": len(QFontDatabase.families()),
+        "loaded": [name for name in STARTUP_MODULES if name in sys.modules],
+    }
+    print(json.dumps(result), flush=True)
+    # Без разрушения окна и QApplication: их время в замер не входит
+    os._exit(0)
+
+
+def bench_startup(args):
+    import json, statistics, subprocess
+    if args.child:
+        startup_child()
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    command = [sys.executable, os.path.abspath(__file__), "startup", "--child"]
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+        wall = (time.perf_counter() - start) * 1000
+        result = json.loads(output.strip().splitlines()[-1])
+        result["wall_ms"] = wall
+        runs.append(result)
+        print(f"import {result['import_ms']:.0f} ms, window shown {result['shown_ms']:.0f} ms, "
+              f"process {wall:.0f} ms, {result['actions']} actions")
+    median = statistics.median(run["shown_ms"] for run in runs)
+    wall = statistics.median(run["wall_ms"] for run in runs)
+    loaded = runs[-1]["loaded"]
+    print(f"median time to window shown: {median:.0f} ms (process {wall:.0f} ms), "
+          f"{runs[-1]['actions']} actions, {runs[-1]['families']} font families")
+    print(f"loaded at startup: {', '.join(loaded) or 'none of ' + ', '.join(STARTUP_MODULES)}")
+    errors = []
+    if median > args.max_ms:
+        errors.append(f"window shown in {median:.0f} ms, limit {args.max_ms:.0f} ms")
+    if loaded:
+        errors.append(f"modules imported at startup: {', '.join(loaded)}")
+    if errors:
+        sys.exit("; ".join(errors))
+
+
+def bench_batch(args):
+    import shutil, zipfile
+    from fb2_convert import convert_all
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "books")
+        os.makedirs(os.path.join(folder, "sub"))
+        sample = make_book(os.path.join(tmp, "sample.fb2"), args.paragraphs, sections=20, images=2, image_kb=64)
+        with open(sample, encoding="utf-8") as f:
+            template = f.read()
+        # Отдельные .fb2 и .fb2.zip в подкаталогах плюс один архив-сборник
+        collection = zipfile.ZipFile(os.path.join(folder, "collection.zip"), "w", zipfile.ZIP_DEFLATED)
+        for i in range(args.books):
+            text = template.replace("Synthetic Book", f"Книга {i}")
+            if i % 4 == 0:
+                collection.writestr(f"book{i}.fb2", text)
+            elif i % 4 == 1:
+                with zipfile.ZipFile(os.path.join(folder, "sub", f"book{i}.fb2.zip"), "w", zipfile.ZIP_DEFLATED) as z:
+                    z.writestr(f"book{i}.fb2", text)
+            else:
+                with open(os.path.join(folder, "sub", f"book{i}.fb2"), "w", encoding="utf-8") as f:
+                    f.write(text)
+        collection.close()
+        size = os.path.getsize(sample) * args.books
+        print(f"{args.books} books, {size / 2**20:.1f} MB of FB2, {os.cpu_count()} cores")
+
+        errors = []
+        for fmt, images, workers in (("html", True, 1), ("html", True, args.workers), ("txt", False, args.workers)):
+            out = os.path.join(tmp, "out")
+            shutil.rmtree(out, ignore_errors=True)
+            start = time.perf_counter()
+            stats = convert_all([folder], out, fmt, images, workers)
+            elapsed = time.perf_counter() - start
+            files = [os.path.join(r, n) for r, _, names in os.walk(out) for n in names if n.endswith("." + fmt)]
+            print(f"{fmt:>4} workers={workers or 'all':>3}: {stats['books'] / elapsed:6.1f} books/s, "
+                  f"{stats['read'] / 2**20 / elapsed:6.1f} MB/s, {stats['written'] / 2**20:.1f} MB written, "
+                  f"{len(files)} files, {len(stats['failed'])} failed")
+            if len(files) != args.books or stats["failed"]:
+                errors.append(f"{fmt}: {len(files)} of {args.books} books converted, failed {stats['failed'][:3]}")
+            if fmt == "html":
+                page = os.path.join(out, "collection", "book0.html")
+                with open(page, encoding="utf-8") as f:
+                    html = f.read()
+                image = os.path.join(out, "collection", "book0_files", "img0")
+                if "Книга 0" not in html or 'src="book0_files/img0"' not in html or not os.path.exists(image):
+                    errors.append("HTML from the collection archive is missing its title or images")
+        if "PySide6" in sys.modules:
+            errors.append("batch conversion imported PySide6")
+        if errors:
+            sys.exit("; ".join(errors))
+
+
+def bench_profile(args):
+    import json
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import profiling
+    from book_cache import load_book
+
+    errors = []
+    # Цена выключенного и включённого замера на один вызов
+    n = 200000
+    profiling.enable(False)
+    start = time.perf_counter()
+    for _ in range(n):
+        with profiling.span("x"):
+            pass
+    disabled = (time.perf_counter() - start) / n
+    profiling.enable(True)
+    start = time.perf_counter()
+    for _ in range(n):
+        with profiling.span("x"):
+            pass
+    enabled = (time.perf_counter() - start) / n
+    profiling.clear()
+    print(f"span cost: {disabled * 1e9:.0f} ns disabled, {enabled * 1e9:.0f} ns enabled")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=4, image_kb=64)
+        timings = {}
+        for on in (False, True) * 5:
+            profiling.enable(on)
+            start = time.perf_counter()
+            load_book(path)
+            timings.setdefault(on, []).append(time.perf_counter() - start)
+        off, on = min(timings[False]), min(timings[True])
+        print(f"load without cache: {off * 1000:.0f} ms with timings off, {on * 1000:.0f} ms on "
+              f"({(on - off) / off:+.1%})")
+        if on > off * 1.05 + 0.005:
+            errors.append(f"timings add {(on - off) * 1000:.0f} ms to a {off * 1000:.0f} ms load")
+
+        # Полная загрузка в окне с cProfile, затем лента и скачивание с локального сервера
+        from PySide6.QtWidgets import QApplication
+        from opds_client import OPDSClient
+        from profiling_dialog import ProfilingDialog
+
+        app = QApplication.instance() or QApplication([])
+        profiling.PROFILE_DIR = os.path.join(tmp, "profiles")
+        profiling.clear()
+        profiling.enable(True)
+        profiling.profile_next_load()
+        window = make_window()
+        window.show()
+        window.load_fb2(path)
+        while window.load_task is not None:
+            app.processEvents()
+        window.content.finish_rendering()
+        window.content._load_visible_images()
+        window.page_mode_action.setChecked(True)
+        app.processEvents()
+
+        server = FixtureOPDS(catalogs=2)
+        client = OPDSClient()
+        client.fetch_feed(f"{server.url}/cat/0")
+        client.download(f"{server.url}/book/1.fb2", os.path.join(tmp, "dl.fb2"))
+        client.close()
+        server.close()
+
+        summary = profiling.summary()
+        for name, stage in summary.items():
+            print(f"{name:>14} {stage['category']:>8}: {stage['count']:5} x, total {stage['total_ms']:8.1f} ms, "
+                  f"max {stage['max_ms']:7.1f} ms")
+        missing = [name for name in ("parse", "convert", "first screen", "layout", "image decode",
+                                     "feed fetch", "download") if name not in summary]
+        if missing:
+            errors.append(f"no timings for {', '.join(missing)}")
+
+        trace_path = profiling.export(os.path.join(tmp, "trace.json"), chrome=True)
+        json_path = profiling.export(os.path.join(tmp, "timings.json"), extra={"caches": {}})
+        with open(trace_path, encoding="utf-8") as f:
+            trace = json.load(f)["traceEvents"]
+        with open(json_path, encoding="utf-8") as f:
+            timings = json.load(f)
+        spans = [e for e in trace if e["ph"] == "X"]
+        threads = {e["args"]["name"] for e in trace if e["ph"] == "M"}
+        print(f"chrome trace: {len(spans)} spans on {len(threads)} threads; json: {len(timings['events'])} events")
+        if not spans or any(e["dur"] < 0 or e["ts"] < 0 for e in spans) or len(timings["events"]) != len(spans):
+            errors.append("exported trace is inconsistent")
+
+        if profiling.last_profile is None or not os.path.exists(profiling.last_profile[0]):
+            errors.append("cProfile capture was not saved")
+        else:
+            path, text = profiling.last_profile
+            covered = "(convert)" in text and "(show_book)" in text
+            print(f"cProfile: {os.path.basename(path)}, covers worker and GUI thread: {covered}")
+            if not covered:
+                errors.append("cProfile capture misses the worker or the first screen")
+        dialog = ProfilingDialog()
+        dialog.show()
+        if dialog.tree.topLevelItemCount() != len(summary):
+            errors.append("profiling dialog does not list every stage")
+        dialog.close()
+        window.close()
+        profiling.enable(False)
+    if errors:
+        sys.exit("; ".join(errors))
+
+
+def bench_images(args):
+    import re, zipfile
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    import profiling
+    from fb2_parser import BinaryRef
+
+    app = QApplication.instance() or QApplication([])
+    # Сколько раз картинки читаются из книги, по id
+    reads = {}
+    read = BinaryRef.read_from
+
+    def counted(self, f):
+        reads[self.id] = reads.get(self.id, 0) + 1
+        return read(self, f)
+
+    BinaryRef.read_from = counted
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, sections=args.images, images=args.images,
+                         image=make_image(args.width, args.height, "PNG"), inline=True)
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        # Одна битая картинка: раньше её размер перечитывался при каждой раскладке
+        text = re.sub(r'<binary id="img1" [^>]*>[^<]*</binary>',
+                      '<binary id="img1" content-type="image/png">bm90IGFuIGltYWdl</binary>', text)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        with zipfile.ZipFile(path + ".zip", "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("book.fb2", text)
+        print(f"book: {os.path.getsize(path) / 2**20:.1f} MB, {args.images} PNG images "
+              f"{args.width}x{args.height}, zip {os.path.getsize(path + '.zip') / 2**20:.1f} MB")
+
+        results = {}
+        for label, book in (("fb2", path), ("fb2.zip", path + ".zip")):
+            window = make_window()
+            window.resize(900, 700)
+            window.show()
+            reads.clear()
+            profiling.clear()
+            profiling.enable(True)
+            start = time.perf_counter()
+            window.load_fb2(book)
+            while window.load_task is not None:
+                app.processEvents()
+            if window.book_document is None:
+                sys.exit(f"{label}: the book did not load")
+            # Открытие книги не должно выписывать картинки, которых ещё не показывали
+            app.processEvents()
+            opened = window.book_images.spooled
+            total = len(window.book_images.binaries)
+            window.content.finish_rendering()
+            # Прокрутка до конца с подгрузкой видимых картинок, затем две перераскладки
+            bar = window.content.verticalScrollBar()
+            for value in range(0, bar.maximum() + bar.pageStep(), bar.pageStep()):
+                bar.setValue(value)
+                window.content._load_visible_images()
+            for delta in (2, -2):
+                window.adjust_font_size(delta)
+                app.processEvents()
+            elapsed = time.perf_counter() - start
+            profiling.enable(False)
+            summary = profiling.summary()
+            gui = sum(summary[name]["total_ms"] for name in ("image size", "image decode") if name in summary)
+            spool = summary.get("spool images", {}).get("total_ms", 0)
+            sizes = summary.get("image size", {}).get("count", 0)
+            results[label] = gui
+            print(f"{label:>8}: {elapsed * 1000:7.0f} ms total, images on the GUI thread {gui:7.1f} ms "
+                  f"({sizes} size lookups, {summary.get('image decode', {}).get('count', 0)} decodes), "
+                  f"spool {spool:6.1f} ms ({opened} of {total} images spooled at open), "
+                  f"broken image read {reads.get('img1', 0)}x, most reads of one image {max(reads.values(), default=0)}")
+            if opened >= total:
+                errors.append(f"{label}: all {total} images were spooled before any was shown")
+            if reads.get("img1", 0) > 1:
+                errors.append(f"{label}: the broken image was read {reads['img1']} times")
+            if sizes > 1:
+                errors.append(f"{label}: {sizes} image sizes were read on the GUI thread")
+            window.close_book()
+            window.close()
+
+        # Постраничный режим: шаг масштаба перераскладывает окно, но картинки не декодирует заново
+        window = make_window()
+        window.page_mode_action.setChecked(True)
+        window.resize(900, 700)
+        window.show()
+        window.load_fb2(path)
+        while window.load_task is not None:
+            app.processEvents()
+        document = window.book_document
+        first = next(i for i in range(len(document)) if any(style[0] == "img" for _, _, style in
+                                                             document.paragraph_spans(i)))
+        window.pages.jump_to_part(first)
+        window.pages._prefetch()
+        profiling.clear()
+        profiling.enable(True)
+        steps = (2, -2, 2, -2)
+        for delta in steps:
+            window.adjust_font_size(delta)
+            window.pages._prefetch()
+            app.processEvents()
+        profiling.enable(False)
+        decodes = profiling.summary().get("image decode", {}).get("count", 0)
+        print(f"   pages: {decodes} image decodes in {len(steps)} zoom steps")
+        if decodes:
+            errors.append(f"pages: {decodes} image decodes in {len(steps)} zoom steps")
+        window.close_book()
+        window.close()
+        BinaryRef.read_from = read
+    if results["fb2.zip"] > results["fb2"] * 2 + 100:
+        errors.append(f"images from the zip cost {results['fb2.zip']:.0f} ms on the GUI thread "
+                      f"against {results['fb2']:.0f} ms unzipped")
+    if errors:
+        sys.exit("; ".join(errors))
+
+
+def bench_render(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QEventLoop
+    from fb2_reader import FB2Reader
+
+    app = QApplication.instance() or QApplication([])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_book(os.path.join(tmp, "book.fb2"), args.paragraphs, images=0)
+        print(f"book: {os.path.getsize(path) / 2**20:.1f} MB text body")
+
+        window = make_window()
+        window.show()
+        app.processEvents()
+
+        # Первый экран считаем от получения готовой книги в GUI-потоке: разбор в пуле
+        # одинаков для обоих путей и только размывал бы разницу
+        on_book_loaded = FB2Reader.on_book_loaded
+        received = []
+
+        def timed(self, generation, book):
+            received.append(time.perf_counter())
+            on_book_loaded(self, generation, book)
+
+        FB2Reader.on_book_loaded = timed
+
+        def first_paint(progressive):
+            window.content.progressive = progressive
+            received.clear()
+            window.load_fb2(path)
+            while window.load_task is not None:
+                app.processEvents()
+            window.content.viewport().repaint()
+            return time.perf_counter() - received[0], received[0]
+
+        # Прогрев: файл книги в кэше ОС, модули загружены
+        first_paint(False)
+        window.close_book()
+        # Одним setHtml, как раньше
+        full, _ = first_paint(False)
+        window.close_book()
+
+        # Прогрессивная: первый экран, затем порции из цикла событий
+        loop = QEventLoop()
+        window.content.rendering_finished.connect(loop.quit)
+        ticker = StallTicker()
+        progressive, start = first_paint(True)
+        ticker.start()
+        loop.exec()
+        ticker.stop()
+        total = time.perf_counter() - start
+        FB2Reader.on_book_loaded = on_book_loaded
+        stall = max(ticker.gaps, default=0) * 1000
+
+        print(f"setHtml:     first paint {full * 1000:8.1f} ms")
+        print(f"progressive: first paint {progressive * 1000:8.1f} ms, complete {total * 1000:8.1f} ms, "
+              f"longest event-loop stall {stall:.1f} ms")
+        if window.book_document is None:
+            sys.exit("the book did not load")
+        errors = []
+        if progressive >= full:
+            errors.append(f"progressive first paint {progressive * 1000:.1f} ms is not faster "
+                          f"than setHtml {full * 1000:.1f} ms")
+        if progressive * 1000 > args.max_first_paint:
+            errors.append(f"first paint {progressive * 1000:.1f} ms exceeds {args.max_first_paint} ms")
+        if stall > args.max_stall:
+            errors.append(f"event loop stalled for {stall:.1f} ms while rendering, limit {args.max_stall} ms")
+        if errors:
+            sys.exit("; ".join(errors))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FB2Reader benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("parse", help="ElementTree vs streaming parser: time and peak memory")
+    p.add_argument("--paragraphs", type=int, default=20000)
+    p.add_argument("--images", type=int, default=150)
+    p.add_argument("--image-kb", type=int, default=512)
+    p.set_defaults(func=bench_parse)
+
+    p = sub.add_parser("convert", help="FB2 -> HTML converter scaling in paragraph count")
+    p.add_argument("--paragraphs", type=int, default=10000)
+    p.add_argument("--steps", type=int, default=5)
+    p.add_argument("--max-ratio", type=float, default=3, help="fail if per-paragraph cost varies more")
+    p.set_defaults(func=bench_convert)
+
+    p = sub.add_parser("cache", help="cold vs warm open through the converted-book cache")
+    p.add_argument("--paragraphs", type=int, default=20000)
+    p.add_argument("--images", type=int, default=20)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser("load", help="event-loop responsiveness while a book loads in the background")
+    p.add_argument("--paragraphs", type=int, default=40000)
+    p.add_argument("--images", type=int, default=100)
+    p.add_argument("--max-stall", type=float, default=100, help="fail if the event loop stalls longer (ms)")
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("opds", help="OPDS client against a local fixture server")
+    p.add_argument("--pages", type=int, default=40)
+    p.add_argument("--delay", type=float, default=0.02, help="server think time per request (s)")
+    p.set_defaults(func=bench_opds)
+
+    p = sub.add_parser("feedcache", help="OPDS feed cache: hit ratio and bytes saved while browsing")
+    p.add_argument("--catalogs", type=int, default=15)
+    p.add_argument("--delay", type=float, default=0.02, help="server think time per request (s)")
+    p.set_defaults(func=bench_feedcache)
+
+    p = sub.add_parser("download", help="streaming download + zip parsing vs buffering and extracting")
+    p.add_argument("--paragraphs", type=int, default=40000)
+    p.add_argument("--images", type=int, default=60)
+    p.set_defaults(func=bench_download)
+
+    p = sub.add_parser("queue", help="bulk download queue and next-page prefetch on a fixture server")
+    p.add_argument("--books", type=int, default=16)
+    p.add_argument("--delay", type=float, default=0.05, help="server think time per request (s)")
+    p.set_defaults(func=bench_queue)
+
+    p = sub.add_parser("library", help="library indexing: cold scan, cover pass, incremental rescan, FTS search")
+    p.add_argument("--books", type=int, default=2000)
+    p.add_argument("--paragraphs", type=int, default=200)
+    p.add_argument("--workers", type=int, default=None)
+    p.set_defaults(func=bench_library)
+
+    p = sub.add_parser("search", help="in-book search: index build, cache, search-as-you-type latency")
+    p.add_argument("--paragraphs", type=int, default=20000)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("pages", help="page mode vs scroll mode: memory, zoom and theme cost by book length")
+    p.add_argument("--paragraphs", type=int, nargs="+", default=[5000, 20000, 50000])
+    p.set_defaults(func=bench_pages)
+
+    p = sub.add_parser("model", help="document model memory vs ElementTree and HTML, random-access rendering")
+    p.add_argument("--paragraphs", type=int, default=20000)
+    p.add_argument("--images", type=int, default=10)
+    p.add_argument("--window", type=int, default=200)
+    p.set_defaults(func=bench_model)
+
+    p = sub.add_parser("toc", help="nested sections: TOC structure check and jump latency during rendering")
+    p.add_argument("--depth", type=int, default=60)
+    p.add_argument("--fanout", type=int, default=5)
+    p.add_argument("--paragraphs", type=int, default=20)
+    p.set_defaults(func=bench_toc)
+
+    p = sub.add_parser("state", help="reading state: writes under continuous scrolling, restore, crash safety")
+    p.add_argument("--paragraphs", type=int, default=5000)
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.set_defaults(func=bench_state)
+
+    p = sub.add_parser("startup", help="cold start: time to window shown and modules loaded, offscreen")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--max-ms", type=float, default=1500, help="fail if the median time to window shown exceeds N ms")
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("batch", help="headless batch conversion: books/s and MB/s with a process pool")
+    p.add_argument("--books", type=int, default=200)
+    p.add_argument("--paragraphs", type=int, default=2000)
+    p.add_argument("--workers", type=int, default=None)
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser("profile", help="timing layer: overhead, stage coverage, trace export, cProfile capture")
+    p.add_argument("--paragraphs", type=int, default=20000)
+    p.set_defaults(func=bench_profile)
+
+    p = sub.add_parser("images", help="lazy images: GUI-thread cost for .fb2 vs .fb2.zip, broken image rereads")
+    p.add_argument("--paragraphs", type=int, default=4000)
+    p.add_argument("--images", type=int, default=100)
+    p.add_argument("--width", type=int, default=1200)
+    p.add_argument("--height", type=int, default=900)
+    p.set_defaults(func=bench_images)
+
+    p = sub.add_parser("render", help="time to first paint: setHtml vs progressive rendering")
+    p.add_argument("--paragraphs", type=int, default=10000)
+    p.add_argument("--max-first-paint", type=float, default=200,
+                   help="fail if first paint after the book is loaded exceeds N ms")
+    p.add_argument("--max-stall", type=float, default=100, help="fail if the event loop stalls longer (ms)")
+    p.set_defaults(func=bench_render)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
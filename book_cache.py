@@ -0,0 +1,133 @@
+import hashlib, json, logging, os, tempfile
+
+import profiling
+from doc_model import Document
+from fb2_html import convert
+from fb2_parser import BinaryRef
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".fb2reader", "cache")
+CACHE_VERSION = 5
+
+log = logging.getLogger(__name__)
+
+
+class BookCache:
+    # Кэш сконвертированных книг: один JSON на книгу, ключ — путь + размер + mtime.
+    # Свежесть записи отмечается mtime файла, при переполнении удаляются самые старые.
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.write_errors = 0
+
+    def key(self, path):
+        st = os.stat(path)
+        ident = f"{CACHE_VERSION}|{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key, kind=None):
+        # Вспомогательные данные книги (например, поисковый индекс) лежат рядом: <key>.<kind>.json
+        return os.path.join(self.directory, f"{key}.{kind}.json" if kind else key + ".json")
+
+    def get(self, path, kind=None):
+        entry_path = self._entry_path(self.key(path), kind)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            # Кэш только для чтения: запись всё равно годится
+            pass
+        self.hits += 1
+        return entry
+
+    def put(self, path, entry, kind=None):
+        # Кэш необязателен: ошибка записи означает лишь промах в следующий раз
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp, self._entry_path(self.key(path), kind))
+            except BaseException:
+                _unlink(tmp)
+                raise
+        except OSError as e:
+            self.write_errors += 1
+            log.warning("book cache write failed: %s", e)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        # Может идти одновременно из загрузки и из построения индекса:
+        # файл, удалённый соседом, просто пропускаем
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _unlink(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                _unlink(os.path.join(self.directory, name))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0, "write_errors": self.write_errors}
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def load_book(path, cache=None, progress=None):
+    with profiling.span("cache read", "load") as span:
+        entry = cache.get(path) if cache is not None else None
+        span.note(hit=entry is not None)
+        if entry is not None:
+            # В кэше модель лежит таблицами JSON, наружу отдаётся Document
+            entry["document"] = Document.from_json(entry["document"])
+            return entry
+    converter, binaries = convert(path, progress)
+    entry = {
+        "title": converter.title,
+        "authors": converter.authors,
+        "cover_id": converter.cover_id,
+        "document": converter.document.to_json(),
+        "binaries": {b.id: [b.content_type, b.offset, b.length, b.size] for b in binaries.values()},
+    }
+    if cache is not None:
+        with profiling.span("cache write", "load"):
+            cache.put(path, entry)
+    entry["document"] = converter.document
+    return entry
+
+
+def entry_binaries(entry):
+    return {id: BinaryRef(id, *ref) for id, ref in entry["binaries"].items()}
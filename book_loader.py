@@ -0,0 +1,112 @@
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+import profiling
+from book_cache import load_book, entry_binaries
+from book_search import BookIndex
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class LoaderSignals(QObject):
+    # Все сигналы несут номер загрузки, чтобы окно игнорировало устаревшие
+    progress = Signal(int, int)
+    finished = Signal(int, object)
+    failed = Signal(int, str)
+
+
+class IndexSignals(QObject):
+    progress = Signal(int, int)
+    finished = Signal(int, object)
+
+
+class BookLoadTask(QRunnable):
+    # Разбор и конвертация книги в пуле потоков; в GUI уходит только готовый результат
+
+    def __init__(self, generation, path, cache=None):
+        super().__init__()
+        self.generation = generation
+        self.path = path
+        self.cache = cache
+        self.signals = LoaderSignals()
+        self._cancelled = threading.Event()
+        self._percent = -1
+        # cProfile по запросу из окна профилирования: окно продолжит его при первой отрисовке
+        self.profiler = None
+        self.profile = profiling.take_profile_request()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def _progress(self, done, total):
+        if self._cancelled.is_set():
+            raise LoadCancelled()
+        percent = done * 100 // total if total else 100
+        if percent != self._percent:
+            self._percent = percent
+            self.signals.progress.emit(self.generation, percent)
+
+    def run(self):
+        if self.profile:
+            self.profiler = profiling.start_profile()
+        try:
+            book = load_book(self.path, self.cache, self._progress)
+            book["binaries"] = entry_binaries(book)
+        except LoadCancelled:
+            return
+        except Exception as e:
+            if not self._cancelled.is_set():
+                self.signals.failed.emit(self.generation, str(e))
+            return
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+        if self._cancelled.is_set():
+            return
+        self.signals.finished.emit(self.generation, book)
+
+
+class BookIndexTask(QRunnable):
+    # Поисковый индекс строится порциями после открытия книги и кладётся в кэш рядом с ней
+
+    BATCH = 500
+
+    def __init__(self, generation, path, texts, cache=None):
+        super().__init__()
+        self.generation = generation
+        self.path = path
+        self.texts = texts
+        self.cache = cache
+        self.signals = IndexSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        try:
+            data = self.cache.get(self.path, "index") if self.cache is not None else None
+            if data is not None:
+                index = BookIndex.from_json(data)
+            else:
+                index = BookIndex()
+                total = len(self.texts)
+                for start in range(0, total, self.BATCH):
+                    if self._cancelled.is_set():
+                        return
+                    with profiling.span("index", "search", paragraphs=self.BATCH):
+                        index.build(self.texts, start, start + self.BATCH)
+                    self.signals.progress.emit(self.generation, index.indexed * 100 // total)
+                if self.cache is not None:
+                    self.cache.put(self.path, index.to_json(), "index")
+        except Exception:
+            # Без индекса книга читается как обычно, просто не работает поиск
+            return
+        if not self._cancelled.is_set():
+            self.signals.finished.emit(self.generation, index)
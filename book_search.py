@@ -0,0 +1,115 @@
+import re
+from bisect import bisect_left
+from functools import lru_cache
+
+WORD = re.compile(r"\w+")
+
+# Упрощённый стеммер: отрезаем самое длинное окончание, оставляя основу не короче 3 букв
+SUFFIXES = frozenset({
+    # русские окончания существительных и прилагательных
+    "иями", "ями", "ами", "иях", "ях", "ах", "ией", "ей", "ой", "ый", "ий", "ая", "яя",
+    "ое", "ее", "ые", "ие", "ых", "их", "ым", "им", "ом", "ем", "ам", "ям", "ую", "юю",
+    "ого", "его", "ому", "ему", "ыми", "ими", "ость", "ости", "остью", "ов", "ев",
+    # глагольные
+    "ться", "тся", "ешь", "ишь", "ете", "ите", "ует", "уют", "ают", "яют", "ить", "ать",
+    "ять", "еть", "ла", "ло", "ли", "ть", "ет", "ит", "ут", "ют", "ат", "ят", "ал", "ил",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    # английские
+    "ing", "edly", "ed", "es", "s", "ly",
+})
+SUFFIX_LENGTHS = sorted({len(s) for s in SUFFIXES}, reverse=True)
+
+MIN_STEM = 3
+
+
+def normalize(word):
+    return word.casefold().replace("ё", "е")
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    # Словарь книги невелик по сравнению с числом слов, поэтому основы кэшируются
+    word = normalize(word)
+    for n in SUFFIX_LENGTHS:
+        if len(word) - n >= MIN_STEM and word[-n:] in SUFFIXES:
+            return word[:-n]
+    return word
+
+
+class BookIndex:
+    # Инвертированный индекс: основа слова -> номера абзацев модели Document,
+    # номер абзаца совпадает с номером блока в документе.
+
+    def __init__(self, postings=None):
+        self.postings = postings or {}
+        self.indexed = 0
+        self._terms = None
+
+    def add(self, index, text):
+        postings = self.postings
+        for term in set(map(stem, WORD.findall(text))):
+            postings.setdefault(term, []).append(index)
+        self.indexed = index + 1
+
+    def build(self, texts, start=0, stop=None):
+        # Порцию можно строить частями: build(texts, 0, 500), build(texts, 500, 1000), ...
+        for i in range(start, len(texts) if stop is None else min(stop, len(texts))):
+            self.add(i, texts[i])
+        self._terms = None
+        return self
+
+    def _prefix(self, prefix):
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        result = set()
+        i = bisect_left(self._terms, prefix)
+        while i < len(self._terms) and self._terms[i].startswith(prefix):
+            result.update(self.postings[self._terms[i]])
+            i += 1
+        return result
+
+    def search(self, query, limit=500):
+        words = WORD.findall(query)
+        if not words:
+            return []
+        # Последнее слово ищем по префиксу — поиск по мере ввода
+        prefix_last = not query[-1].isspace()
+        hits = None
+        for n, word in enumerate(words):
+            term = stem(word)
+            if prefix_last and n == len(words) - 1:
+                found = self._prefix(term)
+            else:
+                found = set(self.postings.get(term, ()))
+            hits = found if hits is None else hits & found
+            if not hits:
+                return []
+        return sorted(hits)[:limit]
+
+    def to_json(self):
+        return self.postings
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls(data)
+        index.indexed = max((ids[-1] for ids in data.values()), default=-1) + 1
+        return index
+
+
+def match_span(text, query):
+    # Позиция первого слова текста, совпадающего с одним из слов запроса
+    terms = [stem(word) for word in WORD.findall(query)]
+    for m in WORD.finditer(text):
+        term = stem(m.group())
+        if any(term == t or term.startswith(t) for t in terms):
+            return m.start(), m.end()
+    return None
+
+
+def snippet(text, query, width=40):
+    span = match_span(text, query)
+    if span is None:
+        return text[:width * 2]
+    start = max(0, span[0] - width)
+    end = min(len(text), span[1] + width)
+    return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
@@ -0,0 +1,266 @@
+import time
+from collections import OrderedDict, deque
+from urllib.parse import unquote
+
+from PySide6.QtWidgets import QTextBrowser
+from PySide6.QtGui import QTextCursor, QTextDocument, QImage, QImageReader, QPixmap
+from PySide6.QtCore import QTimer, Signal, QBuffer, QByteArray, QPoint, QSize, QUrl, Qt
+
+import profiling
+from fb2_html import IMAGE_SCHEME
+
+IMAGE_FORMATS = {
+    "image/jpeg": b"jpeg",
+    "image/jpg": b"jpeg",
+    "image/png": b"png",
+    "image/gif": b"gif",
+    "image/bmp": b"bmp",
+    "image/webp": b"webp",
+    "image/svg+xml": b"svg",
+}
+
+
+def placeholder(size):
+    # 1 бит на пиксель: раскладка сразу правильная, памяти почти нет
+    image = QImage(size, QImage.Format_Mono)
+    image.setColorTable([0xffdddddd, 0xffdddddd])
+    image.fill(0)
+    return image
+
+
+def image_binary(images, name):
+    return images.get(unquote(name.partition(":")[2])) if images is not None else None
+
+
+def image_reader(images, name):
+    # Буфер возвращается вместе с читателем: без него QImageReader останется без данных
+    binary = image_binary(images, name)
+    if binary is None:
+        return None, None
+    buffer = QBuffer()
+    buffer.setData(QByteArray(images.read(binary)))
+    buffer.open(QBuffer.ReadOnly)
+    reader = QImageReader(buffer, IMAGE_FORMATS.get(binary.content_type.lower(), b""))
+    reader.setDecideFormatFromContent(True)
+    return reader, buffer
+
+
+class BookBrowser(QTextBrowser):
+    # Прогрессивная отрисовка: первый экран вставляется сразу,
+    # остальное добавляется порциями из цикла событий.
+    rendering_finished = Signal()
+    jumped = Signal(int)
+
+    FIRST_SCREEN_CHARS = 16 * 1024
+    BATCH_CHARS = 32 * 1024
+    SLICE_MS = 12
+    # Пока ждём переход к ещё не вставленному месту, порции крупнее
+    CATCH_UP_SLICE_MS = 40
+
+    progressive = True
+
+    # Картинки: при раскладке отдаётся заглушка нужного размера,
+    # декодируются только попавшие на экран, декодированные живут в LRU.
+    MAX_IMAGE_WIDTH = 800
+    IMAGE_CACHE_SIZE = 32
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = deque()
+        self._cursor = None
+        self._jump_target = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._render_slice)
+
+        self.book_images = None
+        self._images = OrderedDict()
+        self._placeholders = {}
+        # Размеры для раскладки, включая None для битых картинок: их не перечитываем
+        self._sizes = {}
+        self._image_timer = QTimer(self)
+        self._image_timer.setSingleShot(True)
+        self._image_timer.setInterval(30)
+        self._image_timer.timeout.connect(self._load_visible_images)
+        self.verticalScrollBar().valueChanged.connect(lambda: self._image_timer.start())
+        self.rendering_finished.connect(lambda: self._image_timer.start())
+
+    def set_images(self, book_images):
+        self.book_images = book_images
+        self._images.clear()
+        self._placeholders.clear()
+        self._sizes.clear()
+
+    def set_html_progressive(self, parts):
+        self.stop_rendering()
+        if not self.progressive:
+            with profiling.span("layout", "layout", paragraphs=len(parts), mode="setHtml"):
+                self.setHtml("".join(parts))
+            self.rendering_finished.emit()
+            return
+        self.clear()
+        self._pending = deque(parts)
+        self._cursor = QTextCursor(self.document())
+        with profiling.span("first screen", "layout"):
+            self._insert_batch(self.FIRST_SCREEN_CHARS)
+        # Курсор виджета стоял в той же точке вставки и уехал в конец первого экрана
+        self.moveCursor(QTextCursor.Start)
+        if self._pending:
+            self._timer.start()
+        else:
+            self.rendering_finished.emit()
+
+    def stop_rendering(self):
+        self._timer.stop()
+        self._pending.clear()
+        self._jump_target = None
+
+    def finish_rendering(self):
+        # Дорисовать всё оставшееся синхронно
+        while self._pending:
+            self._insert_batch(self.BATCH_CHARS)
+        if self._timer.isActive():
+            self._timer.stop()
+            self.rendering_finished.emit()
+
+    def jump_pending(self):
+        return self._jump_target is not None
+
+    def current_part(self):
+        # Логическая позиция — номер абзаца вверху экрана, а не положение полосы прокрутки
+        bar = self.verticalScrollBar()
+        if not self._pending and bar.value() == bar.maximum():
+            return self.document().blockCount() - 1
+        return self.cursorForPosition(QPoint(0, 0)).blockNumber()
+
+    def block(self, index):
+        return self.document().findBlockByNumber(index)
+
+    def jump_to_part(self, index):
+        # Номер фрагмента совпадает с номером блока документа. Если до него ещё
+        # не дорисовали, переход случится, когда вставится нужная порция,
+        # а интерфейс тем временем не блокируется.
+        document = self.document()
+        if self._pending and document.blockCount() <= index:
+            self._jump_target = index
+            return
+        self._jump_target = None
+        block = document.findBlockByNumber(index)
+        if block.isValid():
+            top = document.documentLayout().blockBoundingRect(block).top()
+            self.verticalScrollBar().setValue(int(top))
+            self.jumped.emit(index)
+
+    def _insert_batch(self, limit):
+        batch = []
+        size = 0
+        while self._pending and size < limit:
+            part = self._pending.popleft()
+            batch.append(part)
+            size += len(part)
+        if not batch:
+            return
+        self._cursor.movePosition(QTextCursor.End)
+        if not self._cursor.atStart():
+            # Первый блок фрагмента сливается с текущим и теряет свой формат
+            # (заголовок становится абзацем), поэтому сливаем пустышку.
+            batch.insert(0, "<p>&nbsp;</p>")
+        self._cursor.insertHtml("".join(batch))
+        self._image_timer.start()
+        if self._jump_target is not None and (
+                not self._pending or self.document().blockCount() > self._jump_target):
+            self.jump_to_part(self._jump_target)
+
+    def _render_slice(self):
+        budget = self.SLICE_MS if self._jump_target is None else self.CATCH_UP_SLICE_MS
+        deadline = time.perf_counter() + budget / 1000
+        with profiling.span("layout", "layout") as span:
+            left = len(self._pending)
+            while self._pending and time.perf_counter() < deadline:
+                self._insert_batch(self.BATCH_CHARS)
+            span.note(paragraphs=left - len(self._pending))
+        if not self._pending:
+            self._timer.stop()
+            self.rendering_finished.emit()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._image_timer.start()
+
+    def loadResource(self, type, url):
+        if type != QTextDocument.ImageResource or url.scheme() != IMAGE_SCHEME:
+            return super().loadResource(type, url)
+        name = url.toString()
+        if name in self._images:
+            self._images.move_to_end(name)
+            return self._images[name]
+        size = self._image_size(name)
+        if size is None:
+            return super().loadResource(type, url)
+        self._placeholders[name] = size
+        return placeholder(size)
+
+    def _reader(self, name):
+        return image_reader(self.book_images, name)
+
+    def _image_size(self, name):
+        if name in self._sizes:
+            return self._sizes[name]
+        binary = image_binary(self.book_images, name)
+        if binary is not None and binary.size:
+            # Размер уже прочитан загрузчиком из заголовка картинки
+            size = QSize(*binary.size)
+        else:
+            with profiling.span("image size", "image", image=name):
+                reader, buffer = self._reader(name)
+                size = reader.size() if reader is not None else QSize()
+        if not size.isValid():
+            size = None
+        elif size.width() > self.MAX_IMAGE_WIDTH:
+            size = size.scaled(self.MAX_IMAGE_WIDTH, size.height(), Qt.KeepAspectRatio)
+        self._sizes[name] = size
+        return size
+
+    def _decode(self, name):
+        with profiling.span("image decode", "image", image=name):
+            reader, buffer = self._reader(name)
+            if reader is None:
+                return None
+            reader.setScaledSize(self._placeholders.get(name) or self._image_size(name) or QSize())
+            image = reader.read()
+        return QPixmap.fromImage(image) if not image.isNull() else None
+
+    def _load_visible_images(self):
+        if not self._placeholders:
+            return
+        document = self.document()
+        block = self.cursorForPosition(QPoint(0, 0)).block()
+        last = self.cursorForPosition(QPoint(self.viewport().width(), self.viewport().height())).block()
+        while block.isValid():
+            it = block.begin()
+            while not it.atEnd():
+                fmt = it.fragment().charFormat()
+                if fmt.isImageFormat():
+                    name = fmt.toImageFormat().name()
+                    if name in self._placeholders and name not in self._images:
+                        pixmap = self._decode(name)
+                        if pixmap is not None:
+                            self._remember(name, pixmap)
+                            document.addResource(QTextDocument.ImageResource, QUrl(name), pixmap)
+                            document.markContentsDirty(block.position(), block.length())
+                        else:
+                            # Не декодируется — остаётся заглушкой, повторно не читаем
+                            del self._placeholders[name]
+                it += 1
+            if block == last:
+                break
+            block = block.next()
+
+    def _remember(self, name, pixmap):
+        self._images[name] = pixmap
+        while len(self._images) > self.IMAGE_CACHE_SIZE:
+            old, _ = self._images.popitem(last=False)
+            size = self._placeholders.get(old)
+            if size is not None:
+                # Вытесненная картинка снова становится заглушкой в документе
+                self.document().addResource(QTextDocument.ImageResource, QUrl(old), placeholder(size))
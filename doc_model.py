@@ -0,0 +1,269 @@
+from array import array
+
+from fb2_parser import XLINK_HREF
+
+# Виды абзацев; номер вида хранится в array('B')
+KINDS = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "subtitle", "text-author", "v",
+         "epigraph", "cite", "empty", "image", "cover")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# Элементы, из которых получается отдельный абзац
+PARAGRAPHS = {"p", "v", "subtitle", "text-author", "tr"}
+
+# Стили строчных фрагментов; ссылка и картинка несут ещё и адрес
+INLINE = {"emphasis": "i", "strong": "b", "strikethrough": "s", "sub": "sub", "sup": "sup", "code": "code"}
+
+
+class Section:
+    __slots__ = ("title", "depth", "start", "end", "parent")
+
+    def __init__(self, title, depth, start, parent):
+        self.title = title
+        self.depth = depth
+        self.start = start
+        self.end = start
+        self.parent = parent
+
+
+class Paragraph:
+    # Представление одного абзаца для чтения; сами данные лежат в таблицах Document
+    __slots__ = ("kind", "text", "spans", "anchors")
+
+    def __init__(self, kind, text, spans, anchors):
+        self.kind = kind
+        self.text = text
+        self.spans = spans
+        self.anchors = anchors
+
+
+class Document:
+    """Компактная модель книги между парсером и отрисовкой.
+
+    Текст абзацев хранится без разметки, вид абзаца — байтом в array,
+    строчное оформление — тройками (начало, конец, стиль) в одном плоском
+    array('I'); одинаковые стили хранятся один раз в таблице styles.
+    """
+    __slots__ = ("texts", "kinds", "span_index", "spans", "styles", "_style_ids", "anchors", "sections")
+
+    def __init__(self):
+        self.texts = []
+        self.kinds = array("B")
+        self.span_index = array("I", [0])
+        self.spans = array("I")
+        self.styles = []
+        self._style_ids = {}
+        self.anchors = {}
+        self.sections = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.texts)
+        return Paragraph(KINDS[self.kinds[i]], self.texts[i], self.paragraph_spans(i), self.anchors.get(i, ()))
+
+    def style_id(self, style):
+        style_id = self._style_ids.get(style)
+        if style_id is None:
+            style_id = self._style_ids[style] = len(self.styles)
+            self.styles.append(style)
+        return style_id
+
+    def append(self, kind, text="", spans=(), anchors=()):
+        self.texts.append(text)
+        self.kinds.append(KIND_CODES[kind])
+        for start, end, style in spans:
+            self.spans.extend((start, end, self.style_id(style)))
+        self.span_index.append(len(self.spans))
+        if anchors:
+            self.anchors[len(self.texts) - 1] = tuple(anchors)
+
+    def paragraph_spans(self, i):
+        spans = self.spans
+        return [(spans[n], spans[n + 1], self.styles[spans[n + 2]])
+                for n in range(self.span_index[i], self.span_index[i + 1], 3)]
+
+    def to_json(self):
+        return {
+            "texts": self.texts,
+            "kinds": self.kinds.tobytes().decode("latin-1"),
+            "span_index": self.span_index.tolist(),
+            "spans": self.spans.tolist(),
+            "styles": [list(style) for style in self.styles],
+            "anchors": {str(i): list(names) for i, names in self.anchors.items()},
+            "sections": [[s.title, s.depth, s.start, s.end, s.parent] for s in self.sections],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        document = cls()
+        document.texts = data["texts"]
+        document.kinds = array("B", data["kinds"].encode("latin-1"))
+        document.span_index = array("I", data["span_index"])
+        document.spans = array("I", data["spans"])
+        for style in data["styles"]:
+            document.style_id(tuple(style))
+        document.anchors = {int(i): tuple(names) for i, names in data["anchors"].items()}
+        for title, depth, start, end, parent in data["sections"]:
+            section = Section(title, depth, start, parent)
+            section.end = end
+            document.sections.append(section)
+        return document
+
+
+class DocumentBuilder:
+    # Линейная сборка Document из потока событий FB2Stream
+
+    def __init__(self):
+        self.document = Document()
+        self.title = ""
+        self.authors = []
+        self.cover_id = None
+        self._stack = []
+        self._text = None
+        self._length = 0
+        self._spans = None
+        self._open = []
+        self._kind = "p"
+        self._depth = 0
+        self._capture = None
+        self._author = []
+        self._anchors = []
+        self._sections = []
+        self._section_title = None
+        self._bodies = 0
+
+    def build(self, stream):
+        for event in stream:
+            self.feed(event)
+        return self.document
+
+    def feed(self, event):
+        kind = event[0]
+        if kind == "text":
+            if self._text is not None:
+                self._text.append(event[1])
+                self._length += len(event[1])
+            elif self._capture is not None:
+                self._capture.append(event[1])
+        elif kind == "start":
+            self._start(event[1], event[2])
+        else:
+            self._end(event[1])
+
+    def _start(self, tag, attrs):
+        stack = self._stack
+        document = self.document
+        if self._text is not None:
+            if tag in INLINE:
+                self._open.append((self._length, (INLINE[tag],)))
+            elif tag == "a":
+                self._open.append((self._length, ("a", attrs.get(XLINK_HREF, ""))))
+            elif tag == "image":
+                href = attrs.get(XLINK_HREF, "")
+                if href.startswith("#"):
+                    offset = self._length
+                    self._spans.append((offset, offset, ("img", href[1:])))
+                # Картинка без закрывающего тега в модели не открывает стиль
+                self._open.append(None)
+            elif tag in ("td", "th") and self._length:
+                self._text.append(" | ")
+                self._length += 3
+        elif "description" in stack:
+            if "title-info" in stack:
+                if tag == "book-title" or (tag in ("first-name", "middle-name", "last-name")
+                                           and stack[-1] == "author"):
+                    self._capture = []
+                elif tag == "image" and stack[-1] == "coverpage":
+                    href = attrs.get(XLINK_HREF, "")
+                    if href.startswith("#"):
+                        self.cover_id = href[1:]
+        elif tag in PARAGRAPHS and "body" in stack:
+            self._open_paragraph(tag)
+        elif tag == "image" and "body" in stack:
+            href = attrs.get(XLINK_HREF, "")
+            if href.startswith("#"):
+                document.append("image", spans=[(0, 0, ("img", href[1:]))])
+        elif tag == "body":
+            self._bodies += 1
+            if self._bodies == 1:
+                if self.cover_id:
+                    document.append("cover", spans=[(0, 0, ("img", self.cover_id))])
+            else:
+                # Примечания и комментарии — один пункт оглавления со своими секциями внутри,
+                # а не сотни номеров после последней главы
+                section = Section("Notes", 1, len(document), None)
+                self._sections.append(len(document.sections))
+                document.sections.append(section)
+        else:
+            if tag == "section" and "body" in stack:
+                parent = self._sections[-1] if self._sections else None
+                section = Section("", len(self._sections) + 1, len(document), parent)
+                self._sections.append(len(document.sections))
+                document.sections.append(section)
+            elif tag == "title" and self._sections and stack[-1] in ("section", "body"):
+                self._section_title = []
+            if "id" in attrs and "body" in stack:
+                # Якорь для ссылок на примечания ставится в ближайший абзац
+                self._anchors.append(attrs["id"])
+        stack.append(tag)
+
+    def _end(self, tag):
+        stack = self._stack
+        stack.pop()
+        document = self.document
+        if self._text is not None:
+            if len(stack) == self._depth:
+                text = "".join(self._text)
+                if text.strip() or self._spans:
+                    if self._section_title is not None and text.strip():
+                        self._section_title.append(" ".join(text.split()))
+                    document.append(self._kind, text, self._spans, self._anchors)
+                    self._anchors = []
+                self._text = None
+            elif tag in INLINE or tag in ("a", "image"):
+                opened = self._open.pop()
+                # Пустой стиль в HTML дал бы закрывающий тег раньше открывающего
+                if opened is not None and opened[0] < self._length:
+                    self._spans.append((opened[0], self._length, opened[1]))
+        elif self._capture is not None:
+            text = " ".join("".join(self._capture).split())
+            self._capture = None
+            if tag == "book-title":
+                self.title = text
+            elif text:
+                self._author.append(text)
+        elif tag == "author" and self._author:
+            self.authors.append(" ".join(self._author))
+            self._author = []
+        elif tag == "empty-line" and "body" in stack:
+            document.append("empty")
+        elif tag == "title" and self._section_title is not None:
+            section = document.sections[self._sections[-1]]
+            section.title = " ".join(self._section_title) or section.title
+            self._section_title = None
+        elif tag == "section" and self._sections and "body" in stack:
+            document.sections[self._sections.pop()].end = len(document)
+        elif tag == "body" and self._bodies > 1 and self._sections:
+            document.sections[self._sections.pop()].end = len(document)
+
+    def _open_paragraph(self, tag):
+        stack = self._stack
+        if stack[-1] == "title":
+            kind = f"h{min(stack.count('section') + 1, 6)}"
+        elif tag in ("subtitle", "text-author", "v"):
+            kind = tag
+        elif "epigraph" in stack:
+            kind = "epigraph"
+        elif "cite" in stack or "annotation" in stack:
+            kind = "cite"
+        else:
+            kind = "p"
+        self._kind = kind
+        self._text = []
+        self._length = 0
+        self._spans = []
+        self._open = []
+        self._depth = len(stack)
+
@@ -0,0 +1,214 @@
+import os, re, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem, QPushButton, QWidget
+)
+from PySide6.QtCore import Qt, QObject, Signal
+
+from opds_client import get_client, DownloadCancelled
+
+LIBRARY_DIR = os.path.join(os.path.expanduser("~"), "FB2Library")
+
+
+class DownloadJob:
+    __slots__ = ("title", "url", "dest", "state", "done", "total", "error", "percent", "_cancelled")
+
+    def __init__(self, title, url, dest):
+        self.title = title
+        self.url = url
+        self.dest = dest
+        self.state = "queued"
+        self.done = 0
+        self.total = 0
+        self.error = ""
+        self.percent = -1
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def describe(self):
+        if self.state == "downloading":
+            size = f"{self.done / 2**20:.1f} MB"
+            if self.total:
+                return f"{self.title} — {self.done * 100 // self.total}% ({size})"
+            return f"{self.title} — {size}"
+        if self.state == "failed":
+            return f"{self.title} — failed: {self.error}"
+        return f"{self.title} — {self.state}"
+
+
+def safe_filename(title):
+    name = re.sub(r'[\\/:*?"<>|\s]+', " ", title).strip(" .")
+    return name[:120] or "book"
+
+
+class DownloadManager(QObject):
+    # Очередь загрузок: общий пул с ограничением параллельности и лимит
+    # на каждый хост, чтобы не перегружать зеркало. Лимит проверяется до
+    # передачи в пул: ждущие своего хоста задачи не занимают потоки пула.
+    job_changed = Signal(object)
+
+    def __init__(self, library_dir=LIBRARY_DIR, max_workers=4, per_host=2, client=None):
+        super().__init__()
+        self.library_dir = library_dir
+        self.per_host = per_host
+        self.client = client or get_client()
+        self.jobs = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+        # хост -> [запущено задач, очередь ждущих]
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _schedule(self, job):
+        with self._hosts_lock:
+            slot = self._hosts.setdefault(urlparse(job.url).netloc, [0, deque()])
+            if slot[0] >= self.per_host:
+                slot[1].append(job)
+                return
+            slot[0] += 1
+        self._executor.submit(self._run, job)
+
+    def _release(self, job):
+        # Освободившееся место хоста сразу отдаём следующей его задаче
+        with self._hosts_lock:
+            slot = self._hosts[urlparse(job.url).netloc]
+            while slot[1]:
+                job = slot[1].popleft()
+                if not job._cancelled.is_set():
+                    break
+            else:
+                slot[0] -= 1
+                return
+        self._executor.submit(self._run, job)
+
+    def _destination(self, title, url):
+        ext = ".fb2.zip" if urlparse(url).path.lower().endswith(".zip") else ".fb2"
+        base = os.path.join(self.library_dir, safe_filename(title))
+        dest = base + ext
+        taken = {job.dest for job in self.jobs}
+        n = 2
+        while dest in taken or os.path.exists(dest):
+            dest = f"{base} ({n}){ext}"
+            n += 1
+        return dest
+
+    def enqueue(self, title, url):
+        os.makedirs(self.library_dir, exist_ok=True)
+        job = DownloadJob(title, url, self._destination(title, url))
+        self.jobs.append(job)
+        self.job_changed.emit(job)
+        self._schedule(job)
+        return job
+
+    def _run(self, job):
+        try:
+            if job._cancelled.is_set():
+                return
+            job.state = "downloading"
+            self.job_changed.emit(job)
+            try:
+                self.client.download(job.url, job.dest, lambda done, total: self._progress(job, done, total),
+                                     job._cancelled.is_set)
+                job.state = "done"
+            except DownloadCancelled:
+                job.state = "cancelled"
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+            self.job_changed.emit(job)
+        finally:
+            self._release(job)
+
+    def _progress(self, job, done, total):
+        job.done, job.total = done, total
+        percent = done * 100 // total if total else done >> 20
+        if percent != job.percent:
+            job.percent = percent
+            self.job_changed.emit(job)
+
+    def cancel(self, job):
+        job.cancel()
+        if job.state == "queued":
+            job.state = "cancelled"
+            self.job_changed.emit(job)
+
+    def pending(self):
+        return sum(1 for job in self.jobs if job.state in ("queued", "downloading"))
+
+
+_manager = None
+
+
+def get_download_manager():
+    global _manager
+    if _manager is None:
+        _manager = DownloadManager()
+    return _manager
+
+
+class DownloadQueueDialog(QDialog):
+    def __init__(self, manager, on_book_downloaded, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Downloads")
+        self.resize(520, 360)
+        self.manager = manager
+        self.on_book_downloaded = on_book_downloaded
+        self.items = {}
+
+        layout = QVBoxLayout(self)
+        self.list_widget = QListWidget()
+        layout.addWidget(self.list_widget)
+        button_layout = QHBoxLayout()
+        open_button = QPushButton("Open")
+        cancel_button = QPushButton("Cancel Download")
+        close_button = QPushButton("Close")
+        button_layout.addWidget(open_button)
+        button_layout.addWidget(cancel_button)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        for job in manager.jobs:
+            self.update_job(job)
+        manager.job_changed.connect(self.update_job)
+        open_button.clicked.connect(self.open_selected)
+        cancel_button.clicked.connect(self.cancel_selected)
+        close_button.clicked.connect(self.close)
+        self.list_widget.itemDoubleClicked.connect(lambda item: self.open_selected())
+
+    def update_job(self, job):
+        item = self.items.get(id(job))
+        if item is None:
+            item = QListWidgetItem()
+            item.setData(Qt.UserRole, job)
+            self.list_widget.addItem(item)
+            self.items[id(job)] = item
+        item.setText(job.describe())
+
+    def selected_job(self):
+        item = self.list_widget.currentItem()
+        return item.data(Qt.UserRole) if item else None
+
+    def open_selected(self):
+        job = self.selected_job()
+        if job is not None and job.state == "done":
+            self.on_book_downloaded(job.dest)
+
+    def cancel_selected(self):
+        job = self.selected_job()
+        if job is not None:
+            self.manager.cancel(job)
+
+
+_queue_dialog = None
+
+
+def show_download_queue(parent: QWidget, on_book_downloaded):
+    global _queue_dialog
+    if _queue_dialog is None:
+        _queue_dialog = DownloadQueueDialog(get_download_manager(), on_book_downloaded, parent)
+    _queue_dialog.show()
+    _queue_dialog.raise_()
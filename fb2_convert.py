@@ -0,0 +1,208 @@
+"""Пакетная конвертация FB2 в HTML или текст без GUI.
+
+    python fb2_convert.py книги/ архив.zip -o out --format html --images
+
+Каталоги обходятся рекурсивно, из .zip берутся все .fb2 внутри. Книги
+конвертируются в процессах-воркерах, каждый пишет результат прямо на диск;
+в главный процесс возвращается только статистика. Модуль не зависит от Qt.
+"""
+import argparse, os, re, sys, time
+from functools import partial
+from html import escape
+from multiprocessing import freeze_support
+from urllib.parse import quote
+
+from doc_model import KINDS
+from fb2_html import HtmlConverter, render
+from fb2_parser import FB2Stream, open_book
+from library import find_books, parallel_map
+
+# Абзацев на одну запись в файл: HTML всей книги целиком в памяти не собирается
+WRITE_BATCH = 1000
+# Не больше книг на задачу воркеру: книги одного архива идут подряд,
+# и архив открывается один раз на пачку
+MAX_BATCH = 64
+
+HTML_HEAD = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title></head>\n'
+             '<body>\n')
+HTML_TAIL = "</body></html>\n"
+TEXT_SKIP = {KINDS.index("image"), KINDS.index("cover")}
+
+_archive = None
+
+
+def open_member(source):
+    # source = (путь к архиву, имя члена); последний архив держим открытым в воркере
+    global _archive
+    import zipfile
+    path, member = source
+    if _archive is None or _archive.filename != path:
+        if _archive is not None:
+            _archive.close()
+        _archive = zipfile.ZipFile(path)
+    return _archive.open(member), _archive.getinfo(member).file_size
+
+
+def find_sources(inputs):
+    # (исходник, относительный путь результата без расширения); исходник — путь
+    # к файлу или (архив, член), если в архиве больше одной книги
+    import zipfile
+    for item in inputs:
+        if os.path.isdir(item):
+            root = item
+            paths = find_books(item)
+        else:
+            root = os.path.dirname(item)
+            paths = [item]
+        for path in paths:
+            name = os.path.relpath(path, root)
+            base = re.sub(r"(\.fb2)?(\.zip)?$", "", name, flags=re.IGNORECASE)
+            if not zipfile.is_zipfile(path):
+                yield path, base
+                continue
+            with zipfile.ZipFile(path) as archive:
+                members = [m for m in archive.namelist() if m.lower().endswith(".fb2")]
+            if len(members) <= 1:
+                # Обычный .fb2.zip: open_book сам достанет книгу или сообщит, что её нет
+                yield path, base
+            else:
+                for member in members:
+                    yield (path, member), os.path.join(base, member[:-4])
+
+
+def safe_name(image_id):
+    return re.sub(r"[^\w.-]", "_", image_id) or "image"
+
+
+def write_images(source, opener, binaries, ids, folder):
+    # Один проход по файлу вперёд: seek назад в сжатом члене архива дорог
+    refs = sorted((binaries[i] for i in ids if i in binaries), key=lambda ref: ref.offset)
+    if not refs:
+        return 0
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    f, _ = opener(source)
+    with f:
+        for ref in refs:
+            data = ref.read_from(f)
+            with open(os.path.join(folder, safe_name(ref.id)), "wb") as out:
+                out.write(data)
+            written += len(data)
+    return written
+
+
+def convert_book(task, out_dir, fmt="html", images=False):
+    # Выполняется в воркере: (исходник, имя) -> (исходник, прочитано, записано, ошибка)
+    source, base = task
+    opener = open_member if isinstance(source, tuple) else open_book
+    target = os.path.join(out_dir, base + (".html" if fmt == "html" else ".txt"))
+    tmp = target + ".part"
+    size = 0
+
+    def progress(done, total):
+        nonlocal size
+        size = total
+
+    try:
+        stream = FB2Stream(source, progress=progress, opener=opener)
+        converter = HtmlConverter()
+        document = converter.build(stream)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        written = 0
+        # Пишем во временный файл и переименовываем: оборванный запуск не оставит половину книги
+        with open(tmp, "w", encoding="utf-8") as out:
+            if fmt == "html":
+                folder = os.path.basename(base) + "_files"
+                src = lambda image_id: f"{quote(folder)}/{quote(safe_name(image_id))}"
+                out.write(HTML_HEAD.format(title=escape(converter.title or os.path.basename(base))))
+                for start in range(0, len(document), WRITE_BATCH):
+                    out.write("\n".join(render(document, start, start + WRITE_BATCH, src)))
+                    out.write("\n")
+                out.write(HTML_TAIL)
+                if images:
+                    ids = {style[1] for style in document.styles if style[0] == "img"}
+                    written += write_images(source, opener, stream.binaries, ids,
+                                            os.path.join(os.path.dirname(target), folder))
+            else:
+                kinds = document.kinds
+                for i, text in enumerate(document.texts):
+                    if kinds[i] not in TEXT_SKIP:
+                        out.write(text)
+                        out.write("\n\n")
+            written += out.tell()
+        os.replace(tmp, target)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return source, size, 0, f"{type(e).__name__}: {e}"
+    return source, size, written, None
+
+
+def batches(tasks, workers):
+    # Пачки помельче, чтобы все воркеры были заняты и на небольших наборах
+    size = max(1, min(MAX_BATCH, len(tasks) // (workers * 4)))
+    return [tasks[i:i + size] for i in range(0, len(tasks), size)]
+
+
+def convert_chunk(chunk, out_dir, fmt, images):
+    return [convert_book(task, out_dir, fmt, images) for task in chunk]
+
+
+def convert_all(inputs, out_dir, fmt="html", images=False, workers=None, progress=None):
+    tasks = list(find_sources(inputs))
+    convert = partial(convert_chunk, out_dir=out_dir, fmt=fmt, images=images)
+    workers = workers or os.cpu_count() or 1
+    # Пачки уже нарезаны по числу воркеров: в пул по одной, пул нужен от двух книг
+    results, pool = parallel_map(convert, batches(tasks, workers), workers, min_items=2, chunksize=1)
+    stats = {"books": 0, "failed": [], "read": 0, "written": 0}
+    try:
+        for chunk in results:
+            for source, size, written, error in chunk:
+                stats["books"] += 1
+                stats["read"] += size
+                stats["written"] += written
+                if error is not None:
+                    stats["failed"].append((source, error))
+                if progress is not None:
+                    progress(stats["books"], len(tasks))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert FB2 books to HTML or plain text without the GUI")
+    parser.add_argument("inputs", nargs="+", help=".fb2 / .fb2.zip files, folders or zip archives of books")
+    parser.add_argument("-o", "--output", required=True, help="output folder")
+    parser.add_argument("--format", choices=("html", "txt"), default="html")
+    parser.add_argument("--images", action="store_true", help="write images next to the HTML")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    last = 0
+
+    def progress(done, total):
+        nonlocal last
+        now = time.perf_counter()
+        if now - last >= 1 or done == total:
+            last = now
+            print(f"\r{done}/{total} books", end="", file=sys.stderr, flush=True)
+
+    stats = convert_all(args.inputs, args.output, args.format, args.images, args.workers, progress)
+    elapsed = time.perf_counter() - start
+    print(file=sys.stderr)
+    for source, error in stats["failed"]:
+        print(f"failed: {' / '.join(source) if isinstance(source, tuple) else source}: {error}", file=sys.stderr)
+    converted = stats["books"] - len(stats["failed"])
+    print(f"{converted} books converted ({len(stats['failed'])} failed) in {elapsed:.1f} s: "
+          f"{stats['books'] / elapsed:.1f} books/s, {stats['read'] / 2**20 / elapsed:.1f} MB/s in, "
+          f"{stats['written'] / 2**20:.1f} MB written")
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    freeze_support()
+    main(sys.argv[1:])
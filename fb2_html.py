@@ -0,0 +1,116 @@
+from html import escape
+from urllib.parse import quote
+
+import profiling
+from doc_model import DocumentBuilder, KINDS
+from fb2_parser import FB2Stream
+
+# Оформление абзацев по виду из модели
+BLOCKS = {
+    "p": ("<p>", "</p>"),
+    "h1": ("<h1>", "</h1>"),
+    "h2": ("<h2>", "</h2>"),
+    "h3": ("<h3>", "</h3>"),
+    "h4": ("<h4>", "</h4>"),
+    "h5": ("<h5>", "</h5>"),
+    "h6": ("<h6>", "</h6>"),
+    "subtitle": ('<p align="center"><b>', "</b></p>"),
+    "text-author": ('<p align="right"><i>', "</i></p>"),
+    "v": ('<p style="margin: 0 0 0 2em;">', "</p>"),
+    "epigraph": ('<p align="right"><i>', "</i></p>"),
+    "cite": ('<p style="margin-left: 2em;">', "</p>"),
+}
+
+
+IMAGE_SCHEME = "fb2img"
+
+
+def image_src(image_id):
+    # Картинки ссылаются на <binary> по id и подгружаются виджетом лениво
+    return f"{IMAGE_SCHEME}:{quote(image_id)}"
+
+
+def _tags(style):
+    if style[0] == "a":
+        return f'<a href="{escape(style[1])}">', "</a>"
+    return f"<{style[0]}>", f"</{style[0]}>"
+
+
+def inline_html(text, spans, src=image_src):
+    if (not text or text.isspace()) and not any(style[0] == "img" for _, _, style in spans):
+        # Без видимого текста Qt выбросил бы блок, и номера блоков разошлись бы с абзацами
+        return "&nbsp;"
+    if not spans:
+        return escape(text, quote=False)
+    # Теги открываются снаружи внутрь и закрываются изнутри наружу;
+    # на одной позиции сначала закрываем, потом картинка, потом открываем
+    marks = []
+    for n, (start, end, style) in enumerate(spans):
+        if style[0] == "img":
+            marks.append(((start, 1, 0, n), f'<img src="{src(style[1])}"/>'))
+            continue
+        if start == end:
+            # Пустые стили из кэша старых версий
+            continue
+        opening, closing = _tags(style)
+        marks.append(((start, 2, -end, -n), opening))
+        marks.append(((end, 0, -start, n), closing))
+    marks.sort(key=lambda mark: mark[0])
+    out = []
+    pos = 0
+    for (at, *_), tag in marks:
+        if at > pos:
+            out.append(escape(text[pos:at], quote=False))
+            pos = at
+        out.append(tag)
+    out.append(escape(text[pos:], quote=False))
+    return "".join(out)
+
+
+def paragraph_html(document, i, src=image_src):
+    kind = KINDS[document.kinds[i]]
+    if kind == "empty":
+        return "<p>&nbsp;</p>"
+    spans = document.paragraph_spans(i)
+    if kind == "image":
+        return f'<p align="center"><img src="{src(spans[0][2][1])}"/></p>'
+    if kind == "cover":
+        return f'<p align="center"><img src="{src(spans[0][2][1])}" width="300"/></p>'
+    opening, closing = BLOCKS[kind]
+    anchors = document.anchors.get(i)
+    if anchors:
+        opening += "".join(f'<a name="{escape(a)}"></a>' for a in anchors)
+    return opening + inline_html(document.texts[i], spans, src) + closing
+
+
+def render(document, start=0, stop=None, src=image_src):
+    # HTML для любого диапазона абзацев: по фрагменту на абзац.
+    # src(id) задаёт адрес картинки; по умолчанию схема для ленивой подгрузки в виджете
+    stop = len(document) if stop is None else min(stop, len(document))
+    return [paragraph_html(document, i, src) for i in range(start, stop)]
+
+
+class HtmlConverter(DocumentBuilder):
+    """Поток событий FB2Stream -> модель Document -> HTML.
+
+    Каждый абзац становится самостоятельным фрагментом,
+    поэтому их можно вставлять в документ порциями в любом месте.
+    """
+
+    def convert(self, stream):
+        self.build(stream)
+        return self.parts
+
+    @property
+    def parts(self):
+        return render(self.document)
+
+
+def convert(path, progress=None):
+    stream = FB2Stream(path, progress=progress)
+    converter = HtmlConverter()
+    with profiling.span("convert", "load") as span:
+        converter.build(stream)
+        # В convert входит и разбор: его доля видна отдельно
+        span.note(parse_ms=stream.parse_time * 1000, paragraphs=len(converter.document))
+    return converter, stream.binaries
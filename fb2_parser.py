@@ -0,0 +1,297 @@
+import base64, os, struct, tempfile, time
+import xml.parsers.expat
+
+import profiling
+
+FB2_NS = "http://www.gribuser.ru/xml/fictionbook/2.0"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XLINK_HREF = "{%s}href" % XLINK_NS
+
+CHUNK_SIZE = 64 * 1024
+# Столько base64 из начала <binary> хватает на заголовок картинки, даже с EXIF
+HEAD_CHARS = 64 * 1024
+
+
+class BinaryRef:
+    # Положение <binary> в файле: offset/length охватывают весь элемент,
+    # base64 декодируется только по запросу. size — (ширина, высота) из
+    # заголовка картинки, None, если формат не распознан.
+    __slots__ = ("id", "content_type", "offset", "length", "size")
+
+    def __init__(self, id, content_type, offset, length=0, size=None):
+        self.id = id
+        self.content_type = content_type
+        self.offset = offset
+        self.length = length
+        self.size = tuple(size) if size else None
+
+    def read(self, path):
+        # Для .zip смещение считается в распакованном потоке: seek вперёд
+        # в сжатом члене архива дочитывает данные, но на диск ничего не пишет
+        f, _ = open_book(path)
+        with f:
+            return self.read_from(f)
+
+    def read_from(self, f):
+        f.seek(self.offset)
+        raw = f.read(self.length)
+        start = raw.find(b">") + 1
+        return base64.b64decode(raw[start:])
+
+
+def image_size(data):
+    # (ширина, высота) по заголовку PNG, JPEG, GIF, BMP или WebP; None, если не вышло
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", data[16:24])
+        if data.startswith(b"GIF8"):
+            return struct.unpack("<HH", data[6:10])
+        if data.startswith(b"BM"):
+            width, height = struct.unpack("<ii", data[18:26])
+            return width, abs(height)
+        if data.startswith(b"\xff\xd8"):
+            i = 2
+            while i + 9 < len(data):
+                if data[i] != 0xFF:
+                    return None
+                marker = data[i + 1]
+                if marker == 0xFF:
+                    i += 1
+                    continue
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                    return width, height
+                i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+            return None
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", data[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = struct.unpack("<I", data[21:25])[0]
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return (int.from_bytes(data[24:27], "little") + 1,
+                        int.from_bytes(data[27:30], "little") + 1)
+    except struct.error:
+        pass
+    return None
+
+
+def head_size(text):
+    # Размер картинки по началу base64-текста <binary>
+    head = "".join(text.split())
+    try:
+        data = base64.b64decode(head[:len(head) // 4 * 4])
+    except ValueError:
+        return None
+    size = image_size(data)
+    return size if size and size[0] > 0 and size[1] > 0 else None
+
+
+def is_zip(path):
+    with open(path, "rb") as f:
+        return f.read(4) == b"PK\x03\x04"
+
+
+SPOOL_PREFIX = "fb2reader-"
+SPOOL_SUFFIX = ".images"
+
+
+class BookImages:
+    # Картинки открытой книги по id <binary>. Из архива каждое чтение заново
+    # распаковывало бы его с начала до картинки, поэтому картинки выписываются
+    # в несжатый временный файл — но только по запросу: архив дочитывается
+    # вперёд до запрошенной картинки, и всё пройденное по дороге сохраняется.
+    # Книга, в которой картинок не смотрели, на диск ничего не пишет.
+
+    def __init__(self, path, binaries):
+        self.path = path
+        self.binaries = binaries
+        self._zip = None
+        self._source = None
+        self._spool = None
+        self._spooled = {}
+        self._order = sorted(binaries.values(), key=lambda ref: ref.offset)
+        self._next = 0
+
+    def get(self, id):
+        return self.binaries.get(id)
+
+    @property
+    def spooled(self):
+        return len(self._spooled)
+
+    def read(self, ref):
+        if self._zip is None:
+            self._zip = is_zip(self.path)
+        if self._zip:
+            spooled = self._spooled.get(ref.id) or self._advance(ref)
+            if spooled is not None:
+                return spooled.read_from(self._spool)
+        return ref.read(self.path)
+
+    def _advance(self, ref):
+        # Один проход вперёд: seek назад в сжатом члене архива дорог
+        with profiling.span("spool images", "image", image=ref.id):
+            try:
+                if self._spool is None:
+                    # Безымянный файл: после падения программы он не остаётся в temp
+                    self._spool = tempfile.TemporaryFile(prefix=SPOOL_PREFIX, suffix=SPOOL_SUFFIX)
+                    self._source, _ = open_book(self.path)
+                out = self._spool
+                out.seek(0, os.SEEK_END)
+                while self._next < len(self._order) and ref.id not in self._spooled:
+                    item = self._order[self._next]
+                    self._source.seek(item.offset)
+                    data = self._source.read(item.length)
+                    self._spooled[item.id] = BinaryRef(item.id, item.content_type, out.tell(), item.length, item.size)
+                    out.write(data)
+                    self._next += 1
+            except OSError:
+                # Без временного файла картинки читаются прямо из архива, просто медленнее
+                self.close()
+                self._zip = False
+                return None
+        return self._spooled.get(ref.id)
+
+    def close(self):
+        for f in (self._source, self._spool):
+            if f is not None:
+                f.close()
+        self._source = self._spool = None
+        self._spooled = {}
+        self._next = 0
+
+
+def remove_stale_spools():
+    # Временные файлы картинок с именем оставались после падений прежних версий
+    folder = tempfile.gettempdir()
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(SPOOL_PREFIX) and name.endswith(SPOOL_SUFFIX):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+
+def find_fb2_member(archive):
+    return next((name for name in archive.namelist() if name.lower().endswith(".fb2")), None)
+
+
+def open_book(path):
+    # (файл, размер): .fb2 открывается как есть, из zip первый .fb2 читается потоком.
+    # Архив узнаём по сигнатуре: каталоги часто отдают .fb2.zip под именем .fb2
+    f = open(path, "rb")
+    if f.read(4) != b"PK\x03\x04":
+        f.seek(0)
+        return f, os.fstat(f.fileno()).st_size
+    f.close()
+    # zipfile нужен только для архивов: не тянем его при запуске
+    import zipfile
+    with zipfile.ZipFile(path) as archive:
+        name = find_fb2_member(archive)
+        if name is None:
+            raise ValueError("FB2 file not found in ZIP archive.")
+        return archive.open(name), archive.getinfo(name).file_size
+
+
+def _name(qname):
+    # "uri local" -> "local" для FB2, "{uri}local" для остальных пространств
+    uri, sep, local = qname.rpartition(" ")
+    if not sep or uri == FB2_NS:
+        return local
+    return "{%s}%s" % (uri, local)
+
+
+class FB2Stream:
+    """Потоковый разбор FB2 через expat.
+
+    Итерация выдаёт события ("start", tag, attrs), ("text", data), ("end", tag)
+    по мере чтения файла кусками. Содержимое <binary> в события не попадает:
+    вместо этого в self.binaries складываются BinaryRef со смещениями.
+    progress(done, total) вызывается после каждого прочитанного куска.
+    opener(path) -> (файл, размер) позволяет читать не только файлы на диске,
+    например члены архива с несколькими книгами. Время чтения и expat
+    копится в self.parse_time.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, progress=None, opener=open_book):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.opener = opener
+        self.binaries = {}
+        self.parse_time = 0.0
+
+    def __iter__(self):
+        events = []
+        parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+        parser.buffer_text = True
+        parser.ordered_attributes = False
+        binary = None
+        head = []
+        head_chars = 0
+
+        def start(qname, attrs):
+            nonlocal binary, head_chars
+            tag = _name(qname)
+            if tag == "binary":
+                binary = BinaryRef(attrs.get("id", ""), attrs.get("content-type", ""),
+                                   parser.CurrentByteIndex)
+                head.clear()
+                head_chars = 0
+                return
+            events.append(("start", tag, {_name(k): v for k, v in attrs.items()}))
+
+        def end(qname):
+            nonlocal binary
+            tag = _name(qname)
+            if tag == "binary" and binary is not None:
+                binary.length = parser.CurrentByteIndex - binary.offset
+                # Размер — из начала base64, уже прочитанного разбором: картинку
+                # для раскладки не нужно ни читать заново, ни декодировать целиком
+                binary.size = head_size("".join(head))
+                self.binaries[binary.id] = binary
+                binary = None
+                return
+            events.append(("end", tag))
+
+        def text(data):
+            nonlocal head_chars
+            if binary is None:
+                events.append(("text", data))
+            elif head_chars < HEAD_CHARS:
+                head.append(data)
+                head_chars += len(data)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+
+        started = time.perf_counter()
+        done = 0
+        f, total = self.opener(self.path)
+        try:
+            with f:
+                while True:
+                    # Разбор перемежается с обработкой событий: считаем только своё время
+                    t = time.perf_counter()
+                    chunk = f.read(self.chunk_size)
+                    parser.Parse(chunk, not chunk)
+                    self.parse_time += time.perf_counter() - t
+                    yield from events
+                    events.clear()
+                    if not chunk:
+                        break
+                    done += len(chunk)
+                    if self.progress is not None:
+                        self.progress(done, total)
+        finally:
+            if profiling.enabled():
+                profiling.record("parse", "load", started, self.parse_time, {"bytes": done})
@@ -1,16 +1,27 @@
-import sys, os, base64, re, json, zipfile
-import xml.etree.ElementTree as ET
-import requests
+import sys, os
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QFileDialog, QVBoxLayout,
-    QTextBrowser, QProgressBar, QPushButton, QSizePolicy, QInputDialog,
-    QListWidget, QDialog, QMessageBox
+    QProgressBar, QPushButton, QSizePolicy, QMessageBox, QDockWidget
 )
-from PySide6.QtGui import QPixmap, QFontDatabase, QAction
-from PySide6.QtCore import Qt
+from PySide6.QtGui import QPixmap, QFontDatabase, QAction, QKeySequence, QTextCursor
+from PySide6.QtCore import Qt, QThreadPool, QTimer
+
+import profiling
+from book_cache import BookCache
+from book_loader import BookLoadTask, BookIndexTask
+from book_search import match_span
+from book_view import BookBrowser
+from fb2_html import render
+from fb2_parser import BookImages, remove_stale_spools
+from page_view import PageView
+from search_panel import SearchPanel
+from toc_panel import TocPanel
 
 class FB2Reader(QMainWindow):
+    # Состояние чтения пишется не чаще раза в STATE_SAVE_MS, как бы часто ни крутили колесо
+    STATE_SAVE_MS = 1000
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("FB2Reader")
@@ -19,6 +30,23 @@ class FB2Reader(QMainWindow):
         self.default_font_size = 16
         self.current_font_size = self.default_font_size
         self.current_font = "Georgia"
+        self.current_colors = ("#ffffff", "#000000")
+        self.current_theme = "light"
+        self.page_mode = False
+        self.book_path = None
+        self.book_document = None
+        self.book_images = None
+        self.book_cache = BookCache()
+        self.load_task = None
+        self.index_task = None
+        self.load_generation = 0
+        self.search_query = ""
+        self.reading_state = None
+        self.saved_state = None
+        self.state_timer = QTimer(self)
+        self.state_timer.setSingleShot(True)
+        self.state_timer.setInterval(self.STATE_SAVE_MS)
+        self.state_timer.timeout.connect(self.save_state)
 
         # Меню
         menu_bar = self.menuBar()
@@ -28,10 +56,18 @@ class FB2Reader(QMainWindow):
         open_action.triggered.connect(self.open_fb2)
         file_menu.addAction(open_action)
 
+        library_action = QAction("Library...", self)
+        library_action.triggered.connect(self.show_library)
+        file_menu.addAction(library_action)
+
         open_opds_action = QAction("Open from OPDS...", self)
         open_opds_action.triggered.connect(self.open_opds_catalog)
         file_menu.addAction(open_opds_action)
 
+        downloads_action = QAction("Downloads...", self)
+        downloads_action.triggered.connect(self.show_downloads)
+        file_menu.addAction(downloads_action)
+
         close_action = QAction("Close Book", self)
         close_action.triggered.connect(self.close_book)
         file_menu.addAction(close_action)
@@ -42,15 +78,24 @@ class FB2Reader(QMainWindow):
             action.triggered.connect(lambda checked, t=theme: self.apply_theme(t))
             settings_menu.addAction(action)
 
-        font_menu = settings_menu.addMenu("Font")
-        for family in sorted(QFontDatabase.families()):
-            action = QAction(family, self)
-            action.triggered.connect(lambda checked, fam=family: self.set_font(fam))
-            font_menu.addAction(action)
+        # Список шрифтов заполняется при первом открытии меню, а не при запуске
+        self.font_menu = settings_menu.addMenu("Font")
+        self.font_menu.aboutToShow.connect(self.populate_font_menu)
+
+        find_font_action = QAction("Find Font...", self)
+        find_font_action.triggered.connect(self.choose_font)
+        self.font_menu.addAction(find_font_action)
 
         custom_font_action = QAction("Choose custom font (.ttf/.otf)", self)
         custom_font_action.triggered.connect(self.select_custom_font)
-        font_menu.addAction(custom_font_action)
+        self.font_menu.addAction(custom_font_action)
+        self.font_menu.addSeparator()
+        self.font_menu_filled = False
+
+        settings_menu.addSeparator()
+        profiling_action = QAction("Profiling...", self)
+        profiling_action.triggered.connect(self.show_profiling)
+        settings_menu.addAction(profiling_action)
 
         self.zoom_in_action = QAction("Zoom In", self)
         self.zoom_in_action.triggered.connect(lambda: self.adjust_font_size(2))
@@ -67,19 +112,36 @@ class FB2Reader(QMainWindow):
         self.view_menu.addAction(self.zoom_in_action)
         self.view_menu.addAction(self.zoom_out_action)
         self.view_menu.addAction(self.reset_zoom_action)
+        self.view_menu.addSeparator()
+        self.page_mode_action = QAction("Page Mode", self)
+        self.page_mode_action.setCheckable(True)
+        self.page_mode_action.toggled.connect(self.set_page_mode)
+        self.view_menu.addAction(self.page_mode_action)
+        find_action = QAction("Find in Book...", self)
+        find_action.setShortcut(QKeySequence.Find)
+        find_action.triggered.connect(self.show_search)
+        self.view_menu.addAction(find_action)
         self.view_menu.menuAction().setVisible(False)
 
         # Виджеты
         self.progress = QProgressBar()
         self.progress.setTextVisible(True)
 
-        self.content = QTextBrowser()
+        self.content = BookBrowser()
         self.content.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.content.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.content.setOpenExternalLinks(True)
         self.content.setReadOnly(True)
         self.content.setFocusPolicy(Qt.StrongFocus)
         self.content.verticalScrollBar().valueChanged.connect(self.update_progress)
+        self.content.verticalScrollBar().rangeChanged.connect(self.update_progress)
+        self.content.jumped.connect(self.highlight_hit)
+
+        # Постраничный режим: раскладывается только текущее окно книги
+        self.pages = PageView()
+        self.pages.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.pages.position_changed.connect(self.update_progress)
+        self.pages.jumped.connect(self.highlight_hit)
 
         self.splash_label = QLabel()
         self.splash_label.setAlignment(Qt.AlignCenter)
@@ -115,6 +177,7 @@ class FB2Reader(QMainWindow):
 
         layout.addWidget(self.splash_container, stretch=1)
         layout.addWidget(self.content, stretch=10)
+        layout.addWidget(self.pages, stretch=10)
         layout.addWidget(self.progress)
 
         container = QWidget()
@@ -122,73 +185,268 @@ class FB2Reader(QMainWindow):
         container.setStyleSheet("background-color: #f4ecd8;")
         self.setCentralWidget(container)
 
+        self.search_panel = SearchPanel()
+        self.search_panel.hit_activated.connect(self.jump_to_hit)
+        self.search_dock = QDockWidget("Search", self)
+        self.search_dock.setWidget(self.search_panel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.search_dock)
+        self.search_dock.hide()
+
+        self.toc_panel = TocPanel()
+        self.toc_panel.section_activated.connect(lambda part: self.current_view().jump_to_part(part))
+        self.toc_dock = QDockWidget("Contents", self)
+        self.toc_dock.setWidget(self.toc_panel)
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.toc_dock)
+        self.toc_dock.hide()
+        toc_action = self.toc_dock.toggleViewAction()
+        toc_action.setShortcut("Ctrl+T")
+        self.view_menu.insertAction(find_action, toc_action)
+
         self.content.hide()
+        self.pages.hide()
         self.progress.hide()
         self.apply_theme("light")
 
     def open_fb2(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Open FB2", os.getcwd(), "FB2 Files (*.fb2)")
+        path, _ = QFileDialog.getOpenFileName(self, "Open FB2", os.getcwd(), "FB2 Files (*.fb2 *.fb2.zip *.zip)")
         if path:
             self.load_fb2(path)
 
     def load_fb2(self, filepath):
+        self.save_state()
+        self.cancel_loading()
+        self.load_generation += 1
+        task = BookLoadTask(self.load_generation, filepath, self.book_cache)
+        task.signals.progress.connect(self.on_load_progress)
+        task.signals.finished.connect(self.on_book_loaded)
+        task.signals.failed.connect(self.on_load_failed)
+        self.load_task = task
+        self.progress.setValue(0)
+        self.progress.setFormat("Loading... %p%")
+        self.progress.show()
+        QThreadPool.globalInstance().start(task)
+
+    def cancel_loading(self):
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.load_task = None
+        if self.index_task is not None:
+            self.index_task.cancel()
+            self.index_task = None
+
+    def on_load_progress(self, generation, percent):
+        if self.load_task is not None and generation == self.load_generation:
+            self.progress.setValue(percent)
+
+    def on_book_loaded(self, generation, book):
+        if self.load_task is None or generation != self.load_generation:
+            return
+        filepath = self.load_task.path
+        profiler = self.load_task.profiler
+        self.load_task = None
+        if profiler is not None:
+            # Профиль загрузки продолжается до первого экрана в потоке GUI
+            profiler.enable()
         try:
-            tree = ET.parse(filepath)
-            root = tree.getroot()
-            ns = {'fb2': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
-            binaries = {b.attrib["id"]: b.text.strip() for b in root.findall("fb2:binary", ns) if b.text}
-
-            html = ""
-            cover = root.find(".//fb2:coverpage/fb2:image", ns)
-            if cover is not None:
-                href = cover.attrib.get("{http://www.w3.org/1999/xlink}href", "")
-                if href.startswith("#"):
-                    img_id = href[1:]
-                    data = binaries.get(img_id)
-                    if data:
-                        html += f'<img src="data:image/jpeg;base64,{data}" width="300"/><br><br>'
-
-            body = root.find("fb2:body", ns)
-            for section in body.findall("fb2:section", ns):
-                title = section.find("fb2:title", ns)
-                if title is not None:
-                    for p in title.findall("fb2:p", ns):
-                        html += f"<h2>{p.text}</h2>"
-                for p in section.findall("fb2:p", ns):
-                    if p.text:
-                        html += f"<p>{p.text}</p>"
-
-            self.content.setHtml(html)
+            self.book_document = None
+            state = self.state_store().load(filepath)
+            if state is not None:
+                # Настройки книги применяются до показа, чтобы не раскладывать её дважды
+                self.current_font = state["font"] or self.current_font
+                self.current_font_size = state["font_size"] or self.current_font_size
+                self.page_mode_action.setChecked(state["page_mode"])
+                self.apply_theme(state["theme"] or self.current_theme)
+            self.saved_state = state
+            self.book_path = filepath
+            self.book_document = book["document"]
+            self.drop_images()
+            self.book_images = BookImages(filepath, book["binaries"])
+            self.show_book(state["part"] if state else 0)
             self.splash_container.hide()
-            self.content.show()
             self.progress.show()
             self.zoom_in_action.setVisible(True)
             self.zoom_out_action.setVisible(True)
             self.reset_zoom_action.setVisible(True)
             self.view_menu.menuAction().setVisible(True)
             self.update_progress()
+            self.toc_panel.set_document(self.book_document)
+            self.start_indexing(generation, filepath, self.book_document.texts)
 
         except Exception as e:
-            self.content.setPlainText(f"Error loading FB2: {e}")
+            self.on_load_failed(generation, str(e))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiling.save_profile(profiler)
+
+    def current_view(self):
+        return self.pages if self.page_mode else self.content
+
+    def show_book(self, part=0):
+        # В документ попадает книга только для активного режима, второй вид пуст
+        if self.page_mode:
+            self.content.stop_rendering()
+            self.content.clear()
+            self.content.hide()
+            self.pages.set_book(self.book_document, self.book_images)
+            self.pages.show()
+            self.pages.setFocus()
+        else:
+            self.pages.clear_book()
+            self.pages.hide()
+            self.content.set_images(self.book_images)
+            self.content.set_html_progressive(render(self.book_document))
+            self.content.show()
+        if part:
+            self.current_view().jump_to_part(part)
+
+    def set_page_mode(self, enabled):
+        if enabled == self.page_mode:
+            return
+        part = self.current_view().current_part() if self.book_document else 0
+        self.page_mode = enabled
+        if self.book_document:
+            self.show_book(part)
+            self.schedule_state_save()
+
+    def start_indexing(self, generation, filepath, texts):
+        self.search_panel.set_book(texts)
+        task = BookIndexTask(generation, filepath, texts, self.book_cache)
+        task.signals.progress.connect(self.on_index_progress)
+        task.signals.finished.connect(self.on_index_ready)
+        self.index_task = task
+        QThreadPool.globalInstance().start(task)
+
+    def on_index_progress(self, generation, percent):
+        if generation == self.load_generation:
+            self.search_panel.set_progress(percent)
+
+    def on_index_ready(self, generation, index):
+        if generation == self.load_generation:
+            self.index_task = None
+            self.search_panel.set_index(index)
+
+    def show_search(self):
+        self.search_dock.show()
+        self.search_panel.focus_query()
+
+    def jump_to_hit(self, part, query):
+        self.search_query = query
+        self.current_view().jump_to_part(part)
+
+    def highlight_hit(self, part):
+        query, self.search_query = self.search_query, ""
+        block = self.current_view().block(part)
+        span = match_span(block.text(), query) if query else None
+        if span is not None and self.page_mode:
+            self.pages.highlight(part, *span)
+        elif span is not None:
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + span[0])
+            cursor.setPosition(block.position() + span[1], QTextCursor.KeepAnchor)
+            self.content.setTextCursor(cursor)
+
+    def on_load_failed(self, generation, message):
+        if generation != self.load_generation:
+            return
+        self.load_task = None
+        self.book_document = None
+        self.splash_container.hide()
+        self.pages.hide()
+        self.content.show()
+        self.content.setPlainText(f"Error loading FB2: {message}")
+        self.update_progress()
+
+    def state_store(self):
+        if self.reading_state is None:
+            from reading_state import ReadingState
+            self.reading_state = ReadingState()
+        return self.reading_state
+
+    def schedule_state_save(self):
+        # Не перезапускаем таймер: при непрерывной прокрутке запись всё равно раз в интервал
+        if not self.state_timer.isActive():
+            self.state_timer.start()
+
+    def save_state(self):
+        self.state_timer.stop()
+        if not self.book_document or self.load_task is not None:
+            return
+        if not self.page_mode and self.content.jump_pending():
+            # Позиция ещё не восстановлена: не затираем её началом книги
+            self.state_timer.start()
+            return
+        state = {
+            "part": self.current_view().current_part(),
+            "font": self.current_font,
+            "font_size": self.current_font_size,
+            "theme": self.current_theme,
+            "page_mode": self.page_mode,
+        }
+        if state != self.saved_state and self.state_store().save(self.book_path, state):
+            self.saved_state = state
+
+    def closeEvent(self, event):
+        self.save_state()
+        self.drop_images()
+        super().closeEvent(event)
+
+    def drop_images(self):
+        # Временный файл картинок из архива закрывается вместе с книгой
+        if self.book_images is not None:
+            self.book_images.close()
+            self.book_images = None
 
     def close_book(self):
+        self.save_state()
+        self.cancel_loading()
+        self.content.stop_rendering()
         self.content.clear()
         self.content.hide()
+        self.pages.clear_book()
+        self.pages.hide()
+        self.book_document = None
+        self.drop_images()
         self.progress.hide()
         self.splash_container.show()
+        self.search_dock.hide()
+        self.search_panel.set_book([])
+        self.toc_dock.hide()
+        self.toc_panel.clear()
         self.view_menu.menuAction().setVisible(False)
 
     def update_progress(self):
-        bar = self.content.verticalScrollBar()
-        max_val = bar.maximum() or 1
-        percent = int(bar.value() / max_val * 100)
+        if self.load_task is not None or not self.book_document:
+            return
+        # Процент считается по номеру абзаца, а не по полосе прокрутки,
+        # которая при прогрессивной отрисовке и в постраничном режиме врёт
+        part = self.current_view().current_part()
+        percent = part * 100 // max(1, len(self.book_document) - 1)
+        if self.toc_dock.isVisible():
+            self.toc_panel.follow(part)
         self.progress.setValue(percent)
         self.progress.setFormat(f"{percent}%")
+        self.schedule_state_save()
 
     def set_font(self, family):
         self.current_font = family
         self.apply_theme("custom")
 
+    def populate_font_menu(self):
+        if self.font_menu_filled:
+            return
+        self.font_menu_filled = True
+        for family in sorted(QFontDatabase.families()):
+            action = QAction(family, self.font_menu)
+            action.triggered.connect(lambda checked, fam=family: self.set_font(fam))
+            self.font_menu.addAction(action)
+
+    def choose_font(self):
+        from font_picker import pick_font
+        family = pick_font(self, self.current_font)
+        if family:
+            self.set_font(family)
+
     def select_custom_font(self):
         path, _ = QFileDialog.getOpenFileName(self, "Select Font", os.getcwd(), "Font Files (*.ttf *.otf)")
         if path:
@@ -208,7 +466,13 @@ class FB2Reader(QMainWindow):
     def apply_theme(self, name):
         if name == "dark": bg, fg = "#121212", "#DDDDDD"
         elif name == "sepia": bg, fg = "#f4ecd8", "#5b4636"
+        elif name == "custom": bg, fg = self.current_colors
         else: bg, fg = "#ffffff", "#000000"
+        self.current_colors = (bg, fg)
+        if name != "custom":
+            self.current_theme = name
+        self.pages.set_style(self.current_font, self.current_font_size, bg, fg)
+        part = self.content.current_part() if self.book_document and not self.page_mode else None
         self.content.setStyleSheet(f"""
             QTextBrowser {{
                 background-color: {bg};
@@ -217,6 +481,11 @@ class FB2Reader(QMainWindow):
                 font-size: {self.current_font_size}px;
             }}
         """)
+        if part:
+            # После переразметки пиксельное смещение другое: возвращаемся к тому же абзацу
+            self.content.jump_to_part(part)
+        if self.book_document:
+            self.schedule_state_save()
 
     def open_opds_catalog(self):
         try:
@@ -227,6 +496,18 @@ class FB2Reader(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "OPDS Error", str(e))
 
+    def show_library(self):
+        from library_dialog import show_library
+        show_library(self, self.load_fb2)
+
+    def show_profiling(self):
+        from profiling_dialog import show_profiling
+        show_profiling(self, self.book_cache)
+
+    def show_downloads(self):
+        from download_manager import show_download_queue
+        show_download_queue(self, self.load_fb2)
+
     def download_selected(self, list_widget, book_map, dialog):
         selected = list_widget.currentItem()
         if not selected:
@@ -236,29 +517,22 @@ class FB2Reader(QMainWindow):
             file_path, _ = QFileDialog.getSaveFileName(self, "Save Book As", f"{selected.text()}.fb2", "FB2 Files (*.fb2 *.fb2.zip)")
             if not file_path:
                 return
-            book_data = requests.get(href).content
-            with open(file_path, "wb") as f:
-                f.write(book_data)
-
-            if file_path.endswith(".zip"):
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    extracted_files = zip_ref.namelist()
-                    fb2_name = next((f for f in extracted_files if f.endswith(".fb2")), None)
-                    if fb2_name:
-                        zip_ref.extract(fb2_name, os.path.dirname(file_path))
-                        fb2_path = os.path.join(os.path.dirname(file_path), fb2_name)
-                        self.load_fb2(fb2_path)
-                        dialog.accept()
-                        return
-                QMessageBox.warning(self, "Error", "FB2 file not found in ZIP archive.")
-            else:
-                self.load_fb2(file_path)
+            from opds import download_book
+            book_path = download_book(self, href, file_path)
+            if book_path:
+                self.load_fb2(book_path)
                 dialog.accept()
         except Exception as e:
             QMessageBox.warning(self, "Download Error", str(e))
 
 if __name__ == "__main__":
+    # В собранном exe воркеры библиотеки (spawn) иначе запустили бы ещё одно окно;
+    # импорт здесь, чтобы не удлинять запуск
+    import multiprocessing
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = FB2Reader()
     window.show()
+    # Уборка temp после показа окна, чтобы не задерживать запуск
+    QTimer.singleShot(0, remove_stale_spools)
     sys.exit(app.exec())
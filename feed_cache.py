@@ -0,0 +1,201 @@
+import hashlib, json, logging, os, re, tempfile, threading, time
+from collections import OrderedDict
+
+FEED_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".fb2reader", "feeds")
+
+log = logging.getLogger(__name__)
+
+
+class FeedRecord:
+    __slots__ = ("url", "body", "etag", "last_modified", "fetched_at", "max_age")
+
+    def __init__(self, url, body, etag=None, last_modified=None, fetched_at=0.0, max_age=0):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.max_age = max_age
+
+    def is_reusable(self):
+        # Без валидаторов и срока свежести запись нечем перепроверить
+        return bool(self.etag or self.last_modified or self.max_age)
+
+    def is_fresh(self, now=None):
+        return ((now or time.time()) - self.fetched_at) < self.max_age
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def no_store(headers):
+    return "no-store" in headers.get("Cache-Control", "").lower()
+
+
+def max_age_from(headers, default):
+    control = headers.get("Cache-Control", "").lower()
+    if "no-store" in control or "no-cache" in control:
+        return 0
+    match = re.search(r"max-age=(\d+)", control)
+    return int(match.group(1)) if match else default
+
+
+class FeedCache:
+    # Сырые ответы с валидаторами лежат на диске, разобранные ленты — в LRU в памяти.
+    # Свежие записи отдаются без сети, устаревшие перепроверяются условным запросом.
+
+    def __init__(self, directory=FEED_CACHE_DIR, default_max_age=300, memory_entries=64,
+                 max_bytes=32 * 2**20):
+        self.directory = directory
+        self.default_max_age = default_max_age
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._parsed = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.write_errors = 0
+
+    def _path(self, url, ext):
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ext)
+
+    def parsed(self, url):
+        with self._lock:
+            item = self._parsed.get(url)
+            if item is None or not item[1].is_fresh():
+                return None
+            self._parsed.move_to_end(url)
+        feed, record = item
+        self.memory_hits += 1
+        self.bytes_saved += len(record.body)
+        return feed
+
+    def remember(self, url, feed, record):
+        if not record.is_reusable():
+            return
+        with self._lock:
+            self._parsed[url] = (feed, record)
+            self._parsed.move_to_end(url)
+            while len(self._parsed) > self.memory_entries:
+                self._parsed.popitem(last=False)
+
+    def load(self, url):
+        with self._lock:
+            item = self._parsed.get(url)
+        if item is not None:
+            return item[1]
+        try:
+            with open(self._path(url, ".json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(self._path(url, ".xml"), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return FeedRecord(url, body, meta.get("etag"), meta.get("last_modified"),
+                          meta.get("fetched_at", 0.0), meta.get("max_age", 0))
+
+    def hit(self, record):
+        self.disk_hits += 1
+        self.bytes_saved += len(record.body)
+
+    def store(self, url, body, headers):
+        self.misses += 1
+        if no_store(headers):
+            # no-store: не пишем ни на диск, ни в память
+            self._forget(url)
+            return FeedRecord(url, body)
+        record = FeedRecord(url, body, headers.get("ETag"), headers.get("Last-Modified"),
+                            time.time(), max_age_from(headers, self.default_max_age))
+        self._write(record)
+        return record
+
+    def _forget(self, url):
+        with self._lock:
+            self._parsed.pop(url, None)
+        for ext in (".xml", ".json"):
+            _unlink(self._path(url, ext))
+
+    def not_modified(self, record, headers):
+        # 304: тело берём из кэша, обновляем валидаторы и срок свежести
+        record.etag = headers.get("ETag", record.etag)
+        record.last_modified = headers.get("Last-Modified", record.last_modified)
+        record.fetched_at = time.time()
+        record.max_age = max_age_from(headers, record.max_age)
+        self.revalidated += 1
+        self.bytes_saved += len(record.body)
+        if no_store(headers):
+            self._forget(record.url)
+            return FeedRecord(record.url, record.body)
+        self._write(record, body=False)
+        return record
+
+    def _write(self, record, body=True):
+        if not record.is_reusable():
+            return
+        meta = {"url": record.url, "etag": record.etag, "last_modified": record.last_modified,
+                "fetched_at": record.fetched_at, "max_age": record.max_age}
+        files = [(".json", json.dumps(meta).encode("utf-8"))]
+        if body:
+            files.insert(0, (".xml", record.body))
+        # Кэш необязателен: лента уже получена, ошибка записи означает лишь промах в следующий раз
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for ext, data in files:
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, self._path(record.url, ext))
+                except BaseException:
+                    _unlink(tmp)
+                    raise
+        except OSError as e:
+            self.write_errors += 1
+            log.warning("feed cache write failed: %s", e)
+            return
+        if body:
+            self.evict()
+
+    def evict(self):
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".xml"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, name[:-4]))
+        total = sum(size for _, size, _ in files)
+        for _, size, key in sorted(files):
+            if total <= self.max_bytes:
+                break
+            for ext in (".xml", ".json"):
+                _unlink(os.path.join(self.directory, key + ext))
+            total -= size
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits + self.revalidated
+        lookups = hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                "revalidated": self.revalidated, "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0, "bytes_saved": self.bytes_saved,
+                "write_errors": self.write_errors}
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,78 @@
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QListWidget, QPushButton, QLabel
+from PySide6.QtGui import QFont, QFontDatabase
+from PySide6.QtCore import Qt
+
+
+class FontPicker(QDialog):
+    # Поиск шрифта по подстроке с образцом текста выбранным шрифтом
+    def __init__(self, current=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Choose Font")
+        self.resize(420, 480)
+
+        layout = QVBoxLayout(self)
+        self.filter = QLineEdit()
+        self.filter.setPlaceholderText("Filter fonts")
+        self.filter.setClearButtonEnabled(True)
+        layout.addWidget(self.filter)
+        self.list_widget = QListWidget()
+        self.list_widget.setUniformItemSizes(True)
+        self.list_widget.addItems(sorted(QFontDatabase.families()))
+        layout.addWidget(self.list_widget)
+        self.sample = QLabel("Съешь же ещё этих мягких французских булок. The quick brown fox.")
+        self.sample.setWordWrap(True)
+        self.sample.setMinimumHeight(48)
+        layout.addWidget(self.sample)
+
+        button_layout = QHBoxLayout()
+        ok_button = QPushButton("OK")
+        cancel_button = QPushButton("Cancel")
+        button_layout.addWidget(ok_button)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+
+        self.filter.textChanged.connect(self.apply_filter)
+        self.list_widget.currentTextChanged.connect(self.show_sample)
+        self.list_widget.itemDoubleClicked.connect(lambda item: self.accept())
+        self.filter.returnPressed.connect(self.accept_first)
+        ok_button.clicked.connect(self.accept)
+        cancel_button.clicked.connect(self.reject)
+
+        if current:
+            items = self.list_widget.findItems(current, Qt.MatchExactly)
+            if items:
+                self.list_widget.setCurrentItem(items[0])
+        self.filter.setFocus()
+
+    def apply_filter(self, text):
+        text = text.casefold()
+        first = None
+        for row in range(self.list_widget.count()):
+            item = self.list_widget.item(row)
+            hidden = text not in item.text().casefold()
+            item.setHidden(hidden)
+            if not hidden and first is None:
+                first = item
+        current = self.list_widget.currentItem()
+        if first is not None and (current is None or current.isHidden()):
+            self.list_widget.setCurrentItem(first)
+
+    def show_sample(self, family):
+        if family:
+            self.sample.setFont(QFont(family, 14))
+
+    def accept_first(self):
+        item = self.list_widget.currentItem()
+        if item is not None and not item.isHidden():
+            self.accept()
+
+    def selected(self):
+        item = self.list_widget.currentItem()
+        return item.text() if item is not None and not item.isHidden() else None
+
+
+def pick_font(parent, current=None):
+    dialog = FontPicker(current, parent)
+    if dialog.exec() == QDialog.Accepted:
+        return dialog.selected()
+    return None
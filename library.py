@@ -0,0 +1,257 @@
+import base64, os, re, sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from fb2_parser import FB2Stream, open_book, XLINK_HREF
+
+LIBRARY_DB = os.path.join(os.path.expanduser("~"), ".fb2reader", "library.sqlite")
+BOOK_EXTENSIONS = (".fb2", ".fb2.zip", ".zip")
+HEADER_CHUNK = 16 * 1024
+COVER_CHUNK = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    title TEXT, authors TEXT, series TEXT, series_index INTEGER,
+    genres TEXT, lang TEXT, cover_id TEXT, cover BLOB
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, authors, series, genres,
+    content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, title, authors, series, genres)
+    VALUES (new.id, new.title, new.authors, new.series, new.genres);
+END;
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, title, authors, series, genres)
+    VALUES ('delete', old.id, old.title, old.authors, old.series, old.genres);
+END;
+"""
+
+
+def read_header(path):
+    # Разбираем только <description>: дальше файл не читается
+    meta = {"title": "", "authors": [], "series": "", "series_index": None,
+            "genres": [], "lang": "", "cover_id": None}
+    stack = []
+    text = None
+    author = []
+    for event in FB2Stream(path, chunk_size=HEADER_CHUNK):
+        kind = event[0]
+        if kind == "text":
+            if text is not None:
+                text.append(event[1])
+            continue
+        if kind == "start":
+            tag, attrs = event[1], event[2]
+            if "title-info" in stack:
+                if tag in ("book-title", "genre", "lang") or (
+                        tag in ("first-name", "middle-name", "last-name") and stack[-1] == "author"):
+                    text = []
+                elif tag == "sequence" and not meta["series"]:
+                    meta["series"] = attrs.get("name", "")
+                    number = attrs.get("number", "")
+                    meta["series_index"] = int(number) if number.isdigit() else None
+                elif tag == "image" and stack[-1] == "coverpage":
+                    href = attrs.get(XLINK_HREF, "")
+                    if href.startswith("#"):
+                        meta["cover_id"] = href[1:]
+            stack.append(tag)
+            continue
+        tag = event[1]
+        stack.pop()
+        if tag == "description":
+            break
+        if text is not None:
+            value = " ".join("".join(text).split())
+            text = None
+            if tag == "book-title":
+                meta["title"] = value
+            elif tag == "genre":
+                meta["genres"].append(value)
+            elif tag == "lang":
+                meta["lang"] = value
+            elif value:
+                author.append(value)
+        elif tag == "author" and author:
+            meta["authors"].append(" ".join(author))
+            author = []
+    return meta
+
+
+def read_cover(path, cover_id):
+    # Обложка лежит в <binary> в конце файла: ищем её по сырым байтам,
+    # без XML-разбора тела книги
+    start = re.compile(rb'<binary[^>]*\bid=["\']%s["\'][^>]*>' % re.escape(cover_id.encode("utf-8")))
+    f, _ = open_book(path)
+    with f:
+        buffer = b""
+        match = None
+        while match is None:
+            chunk = f.read(COVER_CHUNK)
+            if not chunk:
+                return None
+            buffer = buffer[-512:] + chunk
+            match = start.search(buffer)
+        data = buffer[match.end():]
+        while b"</binary>" not in data:
+            chunk = f.read(COVER_CHUNK)
+            if not chunk:
+                return None
+            data += chunk
+    return base64.b64decode(data[:data.index(b"</binary>")])
+
+
+def index_file(path):
+    # Выполняется в процессах-воркерах: только чистые данные, без Qt
+    try:
+        st = os.stat(path)
+        meta = read_header(path)
+    except Exception:
+        return path, None
+    meta["size"] = st.st_size
+    meta["mtime_ns"] = st.st_mtime_ns
+    return path, meta
+
+
+def cover_file(task):
+    # Тоже в воркере: (id, путь, id картинки) -> (id, байты обложки или None)
+    book_id, path, cover_id = task
+    try:
+        return book_id, read_cover(path, cover_id)
+    except Exception:
+        return book_id, None
+
+
+def parallel_map(fn, items, workers, min_items=16, chunksize=16):
+    # Мелкие наборы — в этом же процессе, крупные — в пуле процессов.
+    # -> (результаты по порядку, пул или None); пул закрывает вызывающий
+    if len(items) < min_items or workers == 1:
+        return map(fn, items), None
+    # spawn: форк процесса с потоками Qt небезопасен
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+    return pool.map(fn, items, chunksize=chunksize), pool
+
+
+def find_books(folder):
+    for entry in os.scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            yield from find_books(entry.path)
+        elif entry.name.lower().endswith(BOOK_EXTENSIONS):
+            yield entry.path
+
+
+class Library:
+    # Каталог книг в SQLite с полнотекстовым индексом FTS5 по метаданным.
+    # Повторное сканирование трогает только новые и изменённые по mtime файлы.
+
+    def __init__(self, db_path=LIBRARY_DB):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        if "cover_id" not in [row[1] for row in self.db.execute("PRAGMA table_info(books)")]:
+            # Каталог от старой версии: обложки читались при сканировании
+            self.db.execute("ALTER TABLE books ADD COLUMN cover_id TEXT")
+
+    def folders(self):
+        return [row[0] for row in self.db.execute("SELECT path FROM folders ORDER BY path")]
+
+    def add_folder(self, folder):
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO folders(path) VALUES (?)", (os.path.abspath(folder),))
+
+    def scan(self, folders=None, workers=None, progress=None):
+        folders = folders or self.folders()
+        known = {path: (size, mtime) for path, size, mtime in
+                 self.db.execute("SELECT path, size, mtime_ns FROM books")}
+        seen = set()
+        changed = []
+        for folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            for path in find_books(folder):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Битая ссылка или файл, удалённый посреди сканирования: в каталоге его нет
+                    continue
+                seen.add(path)
+                if known.get(path) != (st.st_size, st.st_mtime_ns):
+                    changed.append(path)
+        removed = [path for path in known if path not in seen
+                   and any(path.startswith(os.path.join(folder, "")) for folder in folders)]
+
+        # Здесь читается только <description>; обложки — отдельным проходом fill_covers
+        results, pool = parallel_map(index_file, changed, workers)
+        try:
+            with self.db:
+                self.db.executemany("DELETE FROM books WHERE path = ?", [(p,) for p in removed + changed])
+                for n, (path, meta) in enumerate(results, 1):
+                    if meta is not None:
+                        self._insert(path, meta)
+                    if progress is not None:
+                        progress(n, len(changed))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return {"indexed": len(changed), "removed": len(removed), "unchanged": len(seen) - len(changed)}
+
+    def _insert(self, path, meta):
+        self.db.execute(
+            "INSERT INTO books(path, size, mtime_ns, title, authors, series, series_index, genres, lang, cover_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, meta["size"], meta["mtime_ns"], meta["title"] or os.path.basename(path),
+             ", ".join(meta["authors"]), meta["series"], meta["series_index"],
+             ", ".join(meta["genres"]), meta["lang"], meta["cover_id"]))
+
+    def missing_covers(self):
+        return self.db.execute(
+            "SELECT id, path, cover_id FROM books WHERE cover IS NULL AND cover_id IS NOT NULL").fetchall()
+
+    def fill_covers(self, thumbnailer, workers=None, progress=None):
+        # Обложка лежит в конце файла, и её чтение — почти весь файл: поэтому
+        # отдельный проход уже после сканирования. Неудача пишется пустой строкой,
+        # чтобы битую обложку не перечитывать при каждом запуске.
+        tasks = self.missing_covers()
+        results, pool = parallel_map(cover_file, tasks, workers)
+        try:
+            with self.db:
+                for n, (book_id, data) in enumerate(results, 1):
+                    cover = thumbnailer(data) if data is not None else None
+                    self.db.execute("UPDATE books SET cover = ? WHERE id = ?", (cover or b"", book_id))
+                    if progress is not None:
+                        progress(n, len(tasks))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return len(tasks)
+
+    def search(self, query="", limit=500):
+        columns = "b.id, b.path, b.title, b.authors, b.series, b.series_index, b.genres, b.lang"
+        words = re.findall(r"\w+", query)
+        if not words:
+            return self.db.execute(
+                f"SELECT {columns} FROM books b ORDER BY b.authors, b.series, b.series_index, b.title LIMIT ?",
+                (limit,)).fetchall()
+        match = " ".join(f'"{word}"*' for word in words)
+        return self.db.execute(
+            f"SELECT {columns} FROM books_fts JOIN books b ON b.id = books_fts.rowid "
+            f"WHERE books_fts MATCH ? ORDER BY rank LIMIT ?", (match, limit)).fetchall()
+
+    def cover(self, book_id):
+        row = self.db.execute("SELECT cover FROM books WHERE id = ?", (book_id,)).fetchone()
+        return row[0] if row else None
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,159 @@
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QListWidget, QListWidgetItem,
+    QPushButton, QFileDialog, QLabel, QWidget
+)
+from PySide6.QtGui import QImage, QPixmap, QIcon
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, QBuffer, QSize, QTimer, Signal
+
+from library import Library
+
+THUMBNAIL_HEIGHT = 96
+
+
+def make_thumbnail(data):
+    # QImage (в отличие от QPixmap) можно использовать вне GUI-потока
+    image = QImage.fromData(data)
+    if image.isNull():
+        return None
+    image = image.scaledToHeight(THUMBNAIL_HEIGHT, Qt.SmoothTransformation)
+    buffer = QBuffer()
+    buffer.open(QBuffer.WriteOnly)
+    image.save(buffer, "JPG", 80)
+    return bytes(buffer.data())
+
+
+class ScanSignals(QObject):
+    progress = Signal(int, int)
+    scanned = Signal(object)
+    cover_progress = Signal(int, int)
+    finished = Signal(object)
+
+
+class ScanTask(QRunnable):
+    def __init__(self, db_path):
+        super().__init__()
+        self.db_path = db_path
+        self.signals = ScanSignals()
+
+    def run(self):
+        library = Library(self.db_path)
+        try:
+            result = library.scan(progress=lambda done, total: self.signals.progress.emit(done, total))
+            # Список показываем сразу, обложки дочитываются следом
+            self.signals.scanned.emit(result)
+            library.fill_covers(make_thumbnail,
+                                progress=lambda done, total: self.signals.cover_progress.emit(done, total))
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            library.close()
+        self.signals.finished.emit(result)
+
+
+class LibraryDialog(QDialog):
+    def __init__(self, on_open_book, parent=None, db_path=None):
+        super().__init__(parent)
+        self.setWindowTitle("Library")
+        self.resize(720, 560)
+        self.library = Library(db_path) if db_path else Library()
+        self.on_open_book = on_open_book
+        self.scan_task = None
+
+        layout = QVBoxLayout(self)
+        self.search = QLineEdit()
+        self.search.setPlaceholderText("Search by title, author, series or genre")
+        layout.addWidget(self.search)
+        self.list_widget = QListWidget()
+        self.list_widget.setIconSize(QSize(THUMBNAIL_HEIGHT * 2 // 3, THUMBNAIL_HEIGHT))
+        self.list_widget.setUniformItemSizes(True)
+        layout.addWidget(self.list_widget)
+        self.status = QLabel()
+        layout.addWidget(self.status)
+
+        button_layout = QHBoxLayout()
+        add_button = QPushButton("Add Folder...")
+        self.rescan_button = QPushButton("Rescan")
+        open_button = QPushButton("Open")
+        close_button = QPushButton("Close")
+        for button in (add_button, self.rescan_button, open_button, close_button):
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+
+        # Поиск по мере ввода, с короткой задержкой
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.refresh)
+        self.search.textChanged.connect(lambda: self.search_timer.start())
+
+        add_button.clicked.connect(self.add_folder)
+        self.rescan_button.clicked.connect(self.rescan)
+        open_button.clicked.connect(self.open_selected)
+        close_button.clicked.connect(self.close)
+        self.list_widget.itemDoubleClicked.connect(lambda item: self.open_selected())
+
+        self.refresh()
+        if self.library.folders():
+            self.rescan()
+
+    def refresh(self):
+        self.list_widget.clear()
+        rows = self.library.search(self.search.text())
+        for book_id, path, title, authors, series, series_index, genres, lang in rows:
+            text = title
+            if authors:
+                text += f"\n{authors}"
+            if series:
+                text += f"\n{series}" + (f" #{series_index}" if series_index else "")
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, path)
+            cover = self.library.cover(book_id)
+            if cover:
+                pixmap = QPixmap()
+                pixmap.loadFromData(cover)
+                item.setIcon(QIcon(pixmap))
+            self.list_widget.addItem(item)
+        self.status.setText(f"{len(rows)} of {self.library.count()} books")
+
+    def add_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Add Folder to Library")
+        if folder:
+            self.library.add_folder(folder)
+            self.rescan()
+
+    def rescan(self):
+        if self.scan_task is not None:
+            return
+        self.rescan_button.setEnabled(False)
+        self.status.setText("Scanning...")
+        self.scan_task = ScanTask(self.library.db_path)
+        self.scan_task.signals.progress.connect(
+            lambda done, total: self.status.setText(f"Indexing {done} / {total}..."))
+        self.scan_task.signals.scanned.connect(lambda result: self.refresh())
+        self.scan_task.signals.cover_progress.connect(
+            lambda done, total: self.status.setText(f"Reading covers {done} / {total}..."))
+        self.scan_task.signals.finished.connect(self.on_scan_finished)
+        QThreadPool.globalInstance().start(self.scan_task)
+
+    def on_scan_finished(self, result):
+        self.scan_task = None
+        self.rescan_button.setEnabled(True)
+        self.refresh()
+        if "error" in result:
+            self.status.setText(f"Scan failed: {result['error']}")
+
+    def open_selected(self):
+        item = self.list_widget.currentItem()
+        if item is not None:
+            self.on_open_book(item.data(Qt.UserRole))
+
+
+_library_dialog = None
+
+
+def show_library(parent: QWidget, on_open_book):
+    global _library_dialog
+    if _library_dialog is None:
+        _library_dialog = LibraryDialog(on_open_book, parent)
+    _library_dialog.show()
+    _library_dialog.raise_()
@@ -1,13 +1,95 @@
-import os, json, zipfile
-import requests
-import xml.etree.ElementTree as ET
-from urllib.parse import urljoin
+import os, json, threading, zipfile
+from concurrent.futures import CancelledError
 
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QListWidget, QPushButton, QFileDialog,
-    QMessageBox, QInputDialog, QWidget, QHBoxLayout
+    QMessageBox, QInputDialog, QWidget, QHBoxLayout, QProgressDialog
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QObject, QEventLoop, Signal
+
+from fb2_parser import find_fb2_member
+from download_manager import get_download_manager, show_download_queue
+from opds_client import get_client, DownloadCancelled
+
+
+class _FutureWaiter(QObject):
+    done = Signal()
+    progress = Signal(int, int)
+
+
+def run_async(parent, fn, *args):
+    return wait_for(parent, get_client().submit(fn, *args))
+
+
+def wait_for(parent, future, dialog=None, on_cancel=None):
+    # Запрос выполняется в пуле клиента, а здесь крутится локальный цикл
+    # событий, чтобы окно не замирало на медленном зеркале. Пока ждём,
+    # открыт модальный для всего приложения диалог: второй поток OPDS
+    # не запустить и главное окно не закрыть.
+    if not future.done():
+        if dialog is None:
+            dialog = QProgressDialog("Loading catalog...", "Cancel", 0, 0, parent)
+            dialog.setWindowTitle("OPDS")
+        dialog.setWindowModality(Qt.ApplicationModal)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        waiter = _FutureWaiter()
+        loop = QEventLoop()
+        waiter.done.connect(loop.quit)
+        future.add_done_callback(lambda f: waiter.done.emit())
+        # Без on_cancel отмена просто бросает ожидание; с ним — просит задачу
+        # остановиться и ждёт, пока она отпустит файл. Esc закрывает диалог
+        # через reject, без сигнала canceled.
+        cancel = on_cancel or loop.quit
+        dialog.canceled.connect(cancel)
+        dialog.rejected.connect(cancel)
+        dialog.open()
+        try:
+            if not future.done():
+                loop.exec()
+        finally:
+            dialog.canceled.disconnect(cancel)
+            dialog.rejected.disconnect(cancel)
+            dialog.close()
+    if not future.done():
+        # Отмена или выход из приложения (exit завершает и вложенные циклы):
+        # result() здесь заблокировал бы GUI-поток до таймаута запроса
+        if on_cancel is not None:
+            on_cancel()
+        future.cancel()
+        raise CancelledError()
+    return future.result()
+
+
+def download_book(parent: QWidget, href: str, file_path: str):
+    # Скачивание с прогрессом и отменой; недокачанный .part остаётся для докачки.
+    # Возвращает путь, который можно сразу открыть (zip читается без распаковки).
+    cancelled = threading.Event()
+    signals = _FutureWaiter()
+    progress_dialog = QProgressDialog("Downloading...", "Cancel", 0, 0, parent)
+    progress_dialog.setWindowTitle("Download")
+
+    def on_progress(done, total):
+        if total:
+            progress_dialog.setMaximum(100)
+            progress_dialog.setValue(done * 100 // total)
+        progress_dialog.setLabelText(f"Downloading... {done // 1024} KB")
+
+    signals.progress.connect(on_progress)
+    future = get_client().submit(get_client().download, href, file_path,
+                                 lambda done, total: signals.progress.emit(done, total), cancelled.is_set)
+    try:
+        wait_for(parent, future, progress_dialog, cancelled.set)
+    except (DownloadCancelled, CancelledError):
+        return None
+
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            if find_fb2_member(archive) is None:
+                QMessageBox.warning(parent, "Error", "FB2 file not found in ZIP archive.")
+                return None
+    return file_path
+
 
 def open_opds_dialog(parent: QWidget, on_book_downloaded):
     opds_file = os.path.join(os.getcwd(), "opds_catalogs.json")
@@ -54,25 +136,14 @@ def open_opds_dialog(parent: QWidget, on_book_downloaded):
         return
 
     base_url = selected.split(" - ", 1)[1]
+    client = get_client()
     try:
-        response = requests.get(base_url)
-        response.raise_for_status()
-        tree = ET.fromstring(response.content)
-        ns = {'atom': 'http://www.w3.org/2005/Atom'}
-
-        entries = tree.findall("atom:entry", ns)
-        if not entries:
+        feed = run_async(parent, client.fetch_feed, base_url)
+        if not feed.entries:
             QMessageBox.information(parent, "No Entries", "No entries found in catalog.")
             return
 
-        subcatalogs = {}
-        for entry in entries:
-            title = entry.findtext("atom:title", namespaces=ns)
-            link_el = entry.find("atom:link", ns)
-            if title and link_el is not None:
-                href = link_el.attrib.get("href")
-                full_href = urljoin(base_url, href)
-                subcatalogs[title] = full_href
+        subcatalogs = dict(feed.entries)
 
         dialog = QDialog(parent)
         dialog.setWindowTitle("Select Subcatalog")
@@ -95,32 +166,21 @@ def open_opds_dialog(parent: QWidget, on_book_downloaded):
         select_button.clicked.connect(load_selected_subcatalog)
         dialog.exec()
 
+    except CancelledError:
+        pass
     except Exception as e:
         QMessageBox.critical(parent, "OPDS Error", str(e))
 
 
 def load_books_from_feed(parent: QWidget, url: str, on_book_downloaded):
+    client = get_client()
     try:
         while url:
-            response = requests.get(url)
-            response.raise_for_status()
-            tree = ET.fromstring(response.content)
-            ns = {'atom': 'http://www.w3.org/2005/Atom'}
-
-            entries = tree.findall("atom:entry", ns)
-
-            books = []
-            subcatalogs = {}
-            for entry in entries:
-                title = entry.findtext("atom:title", namespaces=ns)
-                fb2_link = next((l for l in entry.findall("atom:link", ns) if 'fb2' in l.attrib.get('type', '')), None)
-                nav_link = entry.find("atom:link", ns)
-                if fb2_link and title:
-                    href = urljoin(url, fb2_link.attrib.get("href"))
-                    books.append((title, href))
-                elif nav_link is not None and title:
-                    href = urljoin(url, nav_link.attrib.get("href"))
-                    subcatalogs[title] = href
+            feed = wait_for(parent, client.feed_future(url))
+            if feed.next_url:
+                client.prefetch_feed(feed.next_url)
+            books = feed.books
+            subcatalogs = feed.subcatalogs
 
             if not books and subcatalogs:
                 sub_dialog = QDialog(parent)
@@ -153,6 +213,7 @@ def load_books_from_feed(parent: QWidget, url: str, on_book_downloaded):
             dialog.setWindowTitle("Select Book")
             layout = QVBoxLayout(dialog)
             list_widget = QListWidget()
+            list_widget.setSelectionMode(QListWidget.ExtendedSelection)
             book_map = {title: href for title, href in books}
             for title in book_map:
                 list_widget.addItem(title)
@@ -160,9 +221,11 @@ def load_books_from_feed(parent: QWidget, url: str, on_book_downloaded):
 
             button_layout = QHBoxLayout()
             download_button = QPushButton("Download")
+            queue_button = QPushButton("Add to Queue")
             next_button = QPushButton("Next Page")
             cancel_button = QPushButton("Close")
             button_layout.addWidget(download_button)
+            button_layout.addWidget(queue_button)
             button_layout.addWidget(next_button)
             button_layout.addWidget(cancel_button)
             layout.addLayout(button_layout)
@@ -176,37 +239,32 @@ def load_books_from_feed(parent: QWidget, url: str, on_book_downloaded):
                     file_path, _ = QFileDialog.getSaveFileName(parent, "Save Book As", f"{selected.text()}.fb2", "FB2 Files (*.fb2 *.fb2.zip)")
                     if not file_path:
                         return
-                    book_data = requests.get(href).content
-                    with open(file_path, "wb") as f:
-                        f.write(book_data)
-
-                    if file_path.endswith(".zip"):
-                        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                            extracted_files = zip_ref.namelist()
-                            fb2_name = next((f for f in extracted_files if f.endswith(".fb2")), None)
-                            if fb2_name:
-                                zip_ref.extract(fb2_name, os.path.dirname(file_path))
-                                fb2_path = os.path.join(os.path.dirname(file_path), fb2_name)
-                                on_book_downloaded(fb2_path)
-                                dialog.accept()
-                                return
-                        QMessageBox.warning(parent, "Error", "FB2 file not found in ZIP archive.")
-                    else:
-                        on_book_downloaded(file_path)
+                    book_path = download_book(parent, href, file_path)
+                    if book_path:
+                        on_book_downloaded(book_path)
                         dialog.accept()
                 except Exception as e:
                     QMessageBox.warning(parent, "Download Error", str(e))
 
+            def queue_selected():
+                selected = list_widget.selectedItems()
+                if not selected:
+                    return
+                manager = get_download_manager()
+                for item in selected:
+                    manager.enqueue(item.text(), book_map[item.text()])
+                show_download_queue(parent, on_book_downloaded)
+
             def next_page():
                 nonlocal url
-                next_link = tree.find("atom:link[@rel='next']", ns)
-                if next_link is not None:
-                    url = urljoin(url, next_link.attrib.get("href"))
+                if feed.next_url:
+                    url = feed.next_url
                     dialog.accept()
                 else:
                     QMessageBox.information(parent, "End", "No more pages.")
 
             download_button.clicked.connect(download_selected)
+            queue_button.clicked.connect(queue_selected)
             next_button.clicked.connect(next_page)
             cancel_button.clicked.connect(dialog.reject)
 
@@ -214,5 +272,7 @@ def load_books_from_feed(parent: QWidget, url: str, on_book_downloaded):
             if result == 0:
                 break
 
+    except CancelledError:
+        pass
     except Exception as e:
         QMessageBox.critical(parent, "Feed Error", str(e))
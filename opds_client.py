@@ -0,0 +1,241 @@
+import json, os, re, threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import profiling
+from feed_cache import FeedCache
+
+ATOM_NS = {'atom': 'http://www.w3.org/2005/Atom'}
+
+USER_AGENT = "FB2Reader"
+
+
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class Feed:
+    __slots__ = ("url", "entries", "books", "subcatalogs", "next_url")
+
+    def __init__(self, url, entries, books, subcatalogs, next_url):
+        self.url = url
+        self.entries = entries
+        self.books = books
+        self.subcatalogs = subcatalogs
+        self.next_url = next_url
+
+
+def parse_feed(content, url):
+    tree = ET.fromstring(content)
+    entries = []
+    books = []
+    subcatalogs = {}
+    for entry in tree.findall("atom:entry", ATOM_NS):
+        title = entry.findtext("atom:title", namespaces=ATOM_NS)
+        links = entry.findall("atom:link", ATOM_NS)
+        fb2_link = next((l for l in links if 'fb2' in l.attrib.get('type', '')), None)
+        nav_link = links[0] if links else None
+        if title and nav_link is not None:
+            entries.append((title, urljoin(url, nav_link.attrib.get("href"))))
+        if fb2_link is not None and title:
+            books.append((title, urljoin(url, fb2_link.attrib.get("href"))))
+        elif nav_link is not None and title:
+            subcatalogs[title] = urljoin(url, nav_link.attrib.get("href"))
+    next_link = tree.find("atom:link[@rel='next']", ATOM_NS)
+    next_url = urljoin(url, next_link.attrib.get("href")) if next_link is not None else None
+    return Feed(url, entries, books, subcatalogs, next_url)
+
+
+class OPDSClient:
+    # Одна сессия с пулом соединений на всё приложение: keep-alive между
+    # страницами каталога, таймауты и повторы с экспоненциальной паузой.
+
+    def __init__(self, timeout=(5, 30), retries=3, backoff=0.5, pool_size=8, workers=4,
+                 feed_cache=None):
+        self.timeout = timeout
+        self.feed_cache = feed_cache
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET", "HEAD"))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="opds")
+        self._prefetched = {}
+        self._prefetch_lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def fetch_feed(self, url):
+        with profiling.span("feed fetch", "network", url=url) as span:
+            return self._fetch_feed(url, span)
+
+    def _fetch_feed(self, url, span):
+        cache = self.feed_cache
+        if cache is None:
+            span.note(source="network")
+            return parse_feed(self.get(url).content, url)
+
+        feed = cache.parsed(url)
+        if feed is not None:
+            span.note(source="memory")
+            return feed
+        record = cache.load(url)
+        if record is not None and record.is_fresh():
+            span.note(source="disk")
+            cache.hit(record)
+        else:
+            headers = record.conditional_headers() if record is not None else {}
+            response = self.get(url, headers=headers)
+            if response.status_code == 304 and record is not None:
+                span.note(source="revalidated")
+                record = cache.not_modified(record, response.headers)
+            else:
+                span.note(source="network", bytes=len(response.content))
+                record = cache.store(url, response.content, response.headers)
+        feed = parse_feed(record.body, url)
+        cache.remember(url, feed, record)
+        return feed
+
+    def download(self, url, dest, progress=None, cancelled=None):
+        with profiling.span("download", "network", url=url) as span:
+            return self._download(url, dest, progress, cancelled, span)
+
+    def _download(self, url, dest, progress, cancelled, span):
+        # Потоковая загрузка в dest.part кусками; если .part остался от прерванной
+        # загрузки, докачиваем через Range. If-Range с валидатором первого ответа
+        # (лежит в dest.part.json): если файл на сервере сменился, сервер пришлёт
+        # его целиком, а не хвост другой версии. Готовый файл переименовывается в dest.
+        part = dest + ".part"
+        meta = part + ".json"
+        offset, validator = _resume_point(part, meta, url)
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        with response:
+            if response.status_code == 416 and offset:
+                # Всё уже скачано в прошлый раз — если размер совпадает с файлом на сервере
+                match = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+                if match and int(match.group(1)) == offset:
+                    os.replace(part, dest)
+                    _remove(meta)
+                    return dest
+                restart = True
+            else:
+                response.raise_for_status()
+                # Сервер вернул не тот кусок, что просили: начинаем заново
+                restart = (offset and response.status_code == 206
+                           and not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"))
+            if restart:
+                _remove(part)
+                _remove(meta)
+            else:
+                if response.status_code != 206:
+                    offset = 0
+                    _write_validator(meta, url, response.headers)
+                self._receive(response, part, offset, progress, cancelled, span)
+        if restart:
+            return self._download(url, dest, progress, cancelled, span)
+        os.replace(part, dest)
+        _remove(meta)
+        return dest
+
+    def _receive(self, response, part, offset, progress, cancelled, span):
+        total = _total_size(response, offset)
+        done = offset
+        with open(part, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                if cancelled is not None and cancelled():
+                    raise DownloadCancelled()
+                f.write(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+        span.note(bytes=done - offset, resumed_from=offset)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def prefetch_feed(self, url):
+        # Фоновая загрузка следующей страницы, пока пользователь смотрит текущую
+        with self._prefetch_lock:
+            if url not in self._prefetched:
+                self._prefetched[url] = self.submit(self.fetch_feed, url)
+                while len(self._prefetched) > 16:
+                    self._prefetched.pop(next(iter(self._prefetched)))
+
+    def feed_future(self, url):
+        with self._prefetch_lock:
+            future = self._prefetched.pop(url, None)
+        return future if future is not None else self.submit(self.fetch_feed, url)
+
+    def fetch_many(self, urls):
+        # Параллельная загрузка нескольких лент; порядок результатов как у urls
+        return list(self.executor.map(self.fetch_feed, urls))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def _resume_point(part, meta, url):
+    # (смещение, валидатор); докачка только той же ссылки с известным валидатором
+    try:
+        offset = os.path.getsize(part)
+        with open(meta, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return 0, None
+    if not offset or saved.get("url") != url or not saved.get("validator"):
+        return 0, None
+    return offset, saved["validator"]
+
+
+def _write_validator(meta, url, headers):
+    # В If-Range годится только сильный ETag, иначе Last-Modified
+    etag = headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
+    with open(meta, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "validator": validator}, f)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _total_size(response, offset):
+    match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+    if match:
+        return int(match.group(1))
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else 0
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OPDSClient(feed_cache=FeedCache())
+        return _client
@@ -0,0 +1,296 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+from PySide6.QtWidgets import QWidget
+from PySide6.QtGui import (
+    QTextDocument, QTextCursor, QTextCharFormat, QAbstractTextDocumentLayout,
+    QPainter, QPalette, QColor, QFont
+)
+from PySide6.QtCore import Qt, QTimer, QPointF, QRectF, QSize, QSizeF, Signal
+
+from book_view import image_binary, image_reader
+import profiling
+from doc_model import Document
+from fb2_html import IMAGE_SCHEME, render
+
+
+class PageDocument(QTextDocument):
+    # Документ одного окна книги; картинки берёт из <binary> через виджет
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+
+    def loadResource(self, type, url):
+        if type == QTextDocument.ImageResource and url.scheme() == IMAGE_SCHEME:
+            image = self.view.load_image(url.toString())
+            if image is not None:
+                return image
+        return super().loadResource(type, url)
+
+
+class PageView(QWidget):
+    """Постраничный просмотр без раскладки всей книги.
+
+    Модель книги делится на окна по WINDOW_CHARS символов текста; HTML
+    строится только для раскладываемого окна, в памяти держится
+    раскладка текущего окна и соседних, поэтому смена шрифта, масштаба
+    или темы стоит одинаково для книги любой длины.
+    """
+    position_changed = Signal()
+    jumped = Signal(int)
+
+    WINDOW_CHARS = 64 * 1024
+    CACHED_WINDOWS = 3
+    MARGIN = 24
+    MAX_IMAGE_WIDTH = 800
+    IMAGE_CACHE_SIZE = 32
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.book = Document()
+        self.windows = [0]
+        self.book_images = None
+        self.text_font = QFont("Georgia")
+        self.text_font.setPixelSize(16)
+        self.background = QColor("#ffffff")
+        self.foreground = QColor("#000000")
+        self._documents = OrderedDict()
+        # Ширина картинки от шрифта и размера страницы не зависит: перераскладка
+        # при масштабе, смене шрифта и подготовке соседних окон их не декодирует
+        self._images = OrderedDict()
+        self._window = 0
+        self._page = 0
+        self._highlight = None
+        self._anchor = None
+        self._wheel = 0
+        self._prefetch_timer = QTimer(self)
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(50)
+        self._prefetch_timer.timeout.connect(self._prefetch)
+
+    def set_book(self, book, book_images=None):
+        self.book = book
+        self.book_images = book_images
+        self._images.clear()
+        # Начала окон — номера абзацев, окна режутся только между абзацами
+        self.windows = [0]
+        size = 0
+        for i, text in enumerate(book.texts):
+            if size >= self.WINDOW_CHARS:
+                self.windows.append(i)
+                size = 0
+            size += len(text)
+        self._documents.clear()
+        self._window = self._page = 0
+        self._highlight = None
+        self._anchor = None
+        self.update()
+        self.position_changed.emit()
+
+    def clear_book(self):
+        self.set_book(Document())
+
+    def set_style(self, family, pixel_size, background, foreground):
+        self.background = QColor(background)
+        self.foreground = QColor(foreground)
+        if family != self.text_font.family() or pixel_size != self.text_font.pixelSize():
+            # Переразмечается только текущее окно, соседние — при обращении к ним
+            part = self._anchor if self._anchor is not None else self.current_part()
+            self.text_font = QFont(family)
+            self.text_font.setPixelSize(pixel_size)
+            self._relayout(part)
+        self.update()
+
+    def _page_size(self):
+        return QSizeF(max(1, self.width()), max(1, self.height()))
+
+    def _window_range(self, window):
+        end = self.windows[window + 1] if window + 1 < len(self.windows) else len(self.book)
+        return self.windows[window], end
+
+    def _document(self, window):
+        document = self._documents.get(window)
+        if document is not None:
+            self._documents.move_to_end(window)
+            return document
+        start, end = self._window_range(window)
+        document = PageDocument(self)
+        document.setDefaultFont(self.text_font)
+        document.setDocumentMargin(self.MARGIN)
+        document.setPageSize(self._page_size())
+        with profiling.span("layout", "layout", window=window, paragraphs=end - start):
+            document.setHtml("".join(render(self.book, start, end)))
+            # Раскладка ленивая; всем вызывающим она нужна сразу, так что замер включает её
+            document.pageCount()
+        self._documents[window] = document
+        while len(self._documents) > self.CACHED_WINDOWS:
+            self._documents.popitem(last=False)
+        return document
+
+    def _prefetch(self):
+        # Соседние окна раскладываются заранее, чтобы перелистывание через границу было мгновенным
+        for window in (self._window + 1, self._window - 1):
+            if 0 <= window < len(self.windows) and self.book:
+                self._document(window).pageCount()
+        if self.book:
+            self._document(self._window)
+
+    def _relayout(self, part):
+        self._documents.clear()
+        if self.book:
+            self._show_part(part)
+
+    def load_image(self, name):
+        if name in self._images:
+            self._images.move_to_end(name)
+            return self._images[name]
+        with profiling.span("image decode", "image", image=name):
+            reader, buffer = image_reader(self.book_images, name)
+            if reader is None:
+                return None
+            binary = image_binary(self.book_images, name)
+            # Размер из заголовка уже прочитан загрузчиком
+            size = QSize(*binary.size) if binary.size else reader.size()
+            if size.isValid() and size.width() > self.MAX_IMAGE_WIDTH:
+                reader.setScaledSize(size.scaled(self.MAX_IMAGE_WIDTH, size.height(), Qt.KeepAspectRatio))
+            image = reader.read()
+        # Битая картинка запоминается как None, чтобы не перечитывать её при каждой раскладке
+        self._images[name] = image if not image.isNull() else None
+        while len(self._images) > self.IMAGE_CACHE_SIZE:
+            self._images.popitem(last=False)
+        return self._images[name]
+
+    def page_count(self):
+        return self._document(self._window).pageCount() if self.book else 0
+
+    def current_part(self):
+        if not self.book:
+            return 0
+        if self._window == len(self.windows) - 1 and self._page >= self.page_count() - 1:
+            return len(self.book) - 1
+        document = self._document(self._window)
+        # Размер страницы берётся у документа: при resizeEvent он ещё старый
+        top = self._page * document.pageSize().height() + self.MARGIN
+        position = document.documentLayout().hitTest(QPointF(self.MARGIN, top), Qt.FuzzyHit)
+        return self.windows[self._window] + max(0, document.findBlock(position).blockNumber())
+
+    def block(self, part):
+        window = bisect_right(self.windows, part) - 1
+        return self._document(window).findBlockByNumber(part - self.windows[window])
+
+    def _show_part(self, part):
+        window = max(0, bisect_right(self.windows, part) - 1)
+        document = self._document(window)
+        block = document.findBlockByNumber(part - self.windows[window])
+        page = 0
+        if block.isValid():
+            top = document.documentLayout().blockBoundingRect(block).top()
+            page = min(int(top // self._page_size().height()), document.pageCount() - 1)
+        self._window, self._page = window, max(0, page)
+        # Пока страницу не перелистнули, позиция — именно этот абзац:
+        # повторные смены масштаба не сдвигают её назад
+        self._anchor = part
+        self._changed()
+
+    def jump_to_part(self, part):
+        if not self.book:
+            return
+        part = min(max(0, part), len(self.book) - 1)
+        self._show_part(part)
+        self.jumped.emit(part)
+
+    def highlight(self, part, start, end):
+        self._highlight = (part, start, end)
+        self.update()
+
+    def next_page(self):
+        if self._page + 1 < self.page_count():
+            self._page += 1
+        elif self._window + 1 < len(self.windows):
+            self._window += 1
+            self._page = 0
+        else:
+            return
+        self._anchor = None
+        self._changed()
+
+    def previous_page(self):
+        if self._page > 0:
+            self._page -= 1
+        elif self._window > 0:
+            self._window -= 1
+            self._page = self.page_count() - 1
+        else:
+            return
+        self._anchor = None
+        self._changed()
+
+    def _changed(self):
+        self.update()
+        self.position_changed.emit()
+        self._prefetch_timer.start()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.background)
+        if not self.book:
+            return
+        document = self._document(self._window)
+        height = self._page_size().height()
+        painter.translate(0, -self._page * height)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.clip = QRectF(0, self._page * height, self.width(), height)
+        context.palette.setColor(QPalette.Text, self.foreground)
+        if self._highlight is not None:
+            part, start, end = self._highlight
+            first, last = self._window_range(self._window)
+            if first <= part < last:
+                block = document.findBlockByNumber(part - first)
+                cursor = QTextCursor(document)
+                cursor.setPosition(block.position() + start)
+                cursor.setPosition(block.position() + end, QTextCursor.KeepAnchor)
+                selection = QAbstractTextDocumentLayout.Selection()
+                selection.cursor = cursor
+                fmt = QTextCharFormat()
+                fmt.setBackground(self.palette().highlight())
+                fmt.setForeground(self.palette().highlightedText())
+                selection.format = fmt
+                context.selections = [selection]
+        document.documentLayout().draw(painter, context)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.book and event.oldSize() != event.size():
+            # Раскладка зависит от размера страницы: позицию держим по абзацу
+            self._relayout(self._anchor if self._anchor is not None else self.current_part())
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key in (Qt.Key_PageDown, Qt.Key_Space, Qt.Key_Right, Qt.Key_Down):
+            self.next_page()
+        elif key in (Qt.Key_PageUp, Qt.Key_Backspace, Qt.Key_Left, Qt.Key_Up):
+            self.previous_page()
+        elif key == Qt.Key_Home:
+            self.jump_to_part(0)
+        elif key == Qt.Key_End:
+            self.jump_to_part(len(self.book) - 1)
+        else:
+            super().keyPressEvent(event)
+
+    def wheelEvent(self, event):
+        self._wheel += event.angleDelta().y()
+        while self._wheel <= -120:
+            self._wheel += 120
+            self.next_page()
+        while self._wheel >= 120:
+            self._wheel -= 120
+            self.previous_page()
+
+    def mousePressEvent(self, event):
+        # Щелчок по правой половине — вперёд, по левой — назад
+        if event.position().x() > self.width() / 2:
+            self.next_page()
+        else:
+            self.previous_page()
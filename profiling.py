@@ -0,0 +1,174 @@
+"""Замеры этапов: разбор, конвертация, раскладка, картинки, сеть.
+
+По умолчанию выключены: span() тогда возвращает общий пустой объект,
+и на месте замера остаётся один вызов функции. Включаются из окна
+профилирования или переменной окружения FB2READER_PROFILE=1.
+"""
+import json, os, threading, time
+from collections import deque
+
+PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".fb2reader", "profiles")
+# Последние события для таймлайна; сводка по этапам копится без ограничения
+MAX_EVENTS = 10000
+
+_enabled = os.environ.get("FB2READER_PROFILE", "") not in ("", "0")
+_events = deque(maxlen=MAX_EVENTS)
+_totals = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+_profile_next = False
+last_profile = None
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def clear():
+    with _lock:
+        _events.clear()
+        _totals.clear()
+
+
+def record(name, category, start, duration, args=None):
+    # start и duration в секундах perf_counter
+    event = (name, category, start, duration, threading.get_ident(), threading.current_thread().name, args)
+    with _lock:
+        _events.append(event)
+        total = _totals.get(name)
+        if total is None:
+            _totals[name] = [category, 1, duration, duration]
+        else:
+            total[1] += 1
+            total[2] += duration
+            if duration > total[3]:
+                total[3] = duration
+
+
+class _Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+    def note(self, **args):
+        # Аргументы, известные только к концу этапа
+        self.args.update(args)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def note(self, **args):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name, category="app", **args):
+    # with span("layout", "render", chars=...): ... — аргументы видны в трассе
+    if not _enabled:
+        return NO_SPAN
+    return _Span(name, category, args)
+
+
+def summary():
+    # {этап: {category, count, total_ms, mean_ms, max_ms}} в порядке убывания общего времени
+    with _lock:
+        items = sorted(_totals.items(), key=lambda item: -item[1][2])
+    return {name: {"category": category, "count": count, "total_ms": total * 1000,
+                   "mean_ms": total * 1000 / count, "max_ms": longest * 1000}
+            for name, (category, count, total, longest) in items}
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def to_json(extra=None):
+    data = {
+        "summary": summary(),
+        "events": [{"name": name, "category": category, "start_ms": (start - _origin) * 1000,
+                    "duration_ms": duration * 1000, "thread": thread_name, "args": args or {}}
+                   for name, category, start, duration, _, thread_name, args in events()],
+    }
+    if extra:
+        data.update(extra)
+    return data
+
+
+def to_chrome_trace():
+    # Формат Trace Event: открывается в chrome://tracing и Perfetto
+    pid = os.getpid()
+    trace = []
+    threads = {}
+    for name, category, start, duration, tid, thread_name, args in events():
+        threads[tid] = thread_name
+        trace.append({"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                      "ts": (start - _origin) * 1e6, "dur": duration * 1e6, "args": args or {}})
+    for tid, thread_name in threads.items():
+        trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def export(path, chrome=False, extra=None):
+    data = to_chrome_trace() if chrome else to_json(extra)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=None if chrome else 1)
+    return path
+
+
+def profile_next_load(on=True):
+    global _profile_next
+    _profile_next = on
+
+
+def take_profile_request():
+    # Запрос на cProfile действует на одну загрузку
+    global _profile_next
+    requested, _profile_next = _profile_next, False
+    return requested
+
+
+def start_profile():
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save_profile(profiler, label="load", directory=None, lines=30):
+    # .prof для snakeviz/pstats и текстовая выжимка для окна профилирования
+    global last_profile
+    import io, pstats
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(lines)
+    last_profile = (path, out.getvalue())
+    return path
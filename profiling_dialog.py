@@ -0,0 +1,135 @@
+import os, sys
+
+from PySide6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QCheckBox, QTreeWidget, QTreeWidgetItem,
+    QLabel, QPlainTextEdit, QFileDialog, QWidget
+)
+from PySide6.QtCore import Qt, QTimer
+
+import profiling
+
+COLUMNS = ("Stage", "Category", "Count", "Total ms", "Mean ms", "Max ms")
+
+
+def cache_stats(book_cache):
+    # Кэш лент смотрим, только если OPDS уже открывали: окно не должно тянуть requests
+    stats = {}
+    if book_cache is not None:
+        stats["book_cache"] = book_cache.stats()
+    opds_client = sys.modules.get("opds_client")
+    if opds_client is not None and opds_client._client is not None and opds_client._client.feed_cache is not None:
+        stats["feed_cache"] = opds_client._client.feed_cache.stats()
+    return stats
+
+
+class ProfilingDialog(QDialog):
+    # Сводка по этапам, статистика кэшей и выгрузка замеров для отчёта о медленной книге
+
+    REFRESH_MS = 1000
+
+    def __init__(self, book_cache=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Profiling")
+        self.resize(640, 520)
+        self.book_cache = book_cache
+
+        layout = QVBoxLayout(self)
+        self.enabled_box = QCheckBox("Record timings")
+        self.enabled_box.setChecked(profiling.enabled())
+        self.enabled_box.toggled.connect(profiling.enable)
+        layout.addWidget(self.enabled_box)
+        self.profile_box = QCheckBox("Run cProfile on the next book load")
+        self.profile_box.toggled.connect(profiling.profile_next_load)
+        layout.addWidget(self.profile_box)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(COLUMNS)
+        self.tree.setRootIsDecorated(False)
+        self.tree.setUniformRowHeights(True)
+        layout.addWidget(self.tree, stretch=2)
+        self.caches = QLabel()
+        self.caches.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.caches)
+        self.profile_text = QPlainTextEdit()
+        self.profile_text.setReadOnly(True)
+        self.profile_text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.profile_text.setPlaceholderText("cProfile output of a single load appears here")
+        layout.addWidget(self.profile_text, stretch=1)
+
+        button_layout = QHBoxLayout()
+        clear_button = QPushButton("Clear")
+        json_button = QPushButton("Export JSON...")
+        trace_button = QPushButton("Export Chrome Trace...")
+        close_button = QPushButton("Close")
+        button_layout.addWidget(clear_button)
+        button_layout.addWidget(json_button)
+        button_layout.addWidget(trace_button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        clear_button.clicked.connect(self.clear)
+        json_button.clicked.connect(lambda: self.export(False))
+        trace_button.clicked.connect(lambda: self.export(True))
+        close_button.clicked.connect(self.close)
+
+        # Пока окно открыто, сводка обновляется сама
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.shown_profile = None
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.enabled_box.setChecked(profiling.enabled())
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        self.tree.clear()
+        for name, stage in profiling.summary().items():
+            item = QTreeWidgetItem([name, stage["category"], str(stage["count"]), f"{stage['total_ms']:.1f}",
+                                    f"{stage['mean_ms']:.2f}", f"{stage['max_ms']:.1f}"])
+            for column in range(2, len(COLUMNS)):
+                item.setTextAlignment(column, Qt.AlignRight)
+            self.tree.addTopLevelItem(item)
+        lines = []
+        for name, stats in cache_stats(self.book_cache).items():
+            lines.append(name.replace("_", " ") + ": " + ", ".join(
+                f"{key.replace('_', ' ')} {value:.0%}" if key == "hit_ratio" else f"{key.replace('_', ' ')} {value}"
+                for key, value in stats.items()))
+        self.caches.setText("\n".join(lines))
+        if profiling.last_profile is not self.shown_profile:
+            self.shown_profile = profiling.last_profile
+            path, text = self.shown_profile
+            self.profile_text.setPlainText(f"{path}\n{text}")
+            self.profile_box.setChecked(False)
+
+    def clear(self):
+        profiling.clear()
+        self.refresh()
+
+    def export(self, chrome):
+        if chrome:
+            path, _ = QFileDialog.getSaveFileName(self, "Export Chrome Trace", os.path.join(os.getcwd(), "trace.json"),
+                                                  "Trace Files (*.json)")
+        else:
+            path, _ = QFileDialog.getSaveFileName(self, "Export Timings", os.path.join(os.getcwd(), "timings.json"),
+                                                  "JSON Files (*.json)")
+        if path:
+            profiling.export(path, chrome, {"caches": cache_stats(self.book_cache)})
+
+
+_dialog = None
+
+
+def show_profiling(parent: QWidget, book_cache):
+    global _dialog
+    if _dialog is None:
+        _dialog = ProfilingDialog(book_cache, parent)
+    _dialog.show()
+    _dialog.raise_()
@@ -0,0 +1,75 @@
+import logging, os, sqlite3, time
+
+STATE_DB = os.path.join(os.path.expanduser("~"), ".fb2reader", "state.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reading_state (
+    path TEXT PRIMARY KEY,
+    part INTEGER NOT NULL,
+    font TEXT, font_size INTEGER, theme TEXT, page_mode INTEGER,
+    updated REAL NOT NULL
+);
+"""
+
+FIELDS = ("part", "font", "font_size", "theme", "page_mode")
+# Запись идёт из потока GUI: занятую другим экземпляром базу долго не ждём
+LOCK_TIMEOUT = 0.5
+
+log = logging.getLogger(__name__)
+
+
+class ReadingState:
+    # Позиция и настройки чтения по каждой книге. Каждая запись — одна транзакция
+    # SQLite в режиме WAL: при падении остаётся либо старое, либо новое состояние.
+    # Ошибки базы не мешают читать: они пишутся в лог, позиция просто не запоминается.
+
+    def __init__(self, db_path=STATE_DB):
+        self.db_path = db_path
+        self.db = None
+        self.writes = 0
+        try:
+            if db_path != ":memory:":
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self.db = sqlite3.connect(db_path, timeout=LOCK_TIMEOUT)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            log.warning("reading state unavailable: %s", e)
+            self.close()
+
+    def load(self, path):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(f"SELECT {', '.join(FIELDS)} FROM reading_state WHERE path = ?",
+                                  (os.path.abspath(path),)).fetchone()
+        except sqlite3.Error as e:
+            log.warning("reading state not loaded: %s", e)
+            return None
+        if row is None:
+            return None
+        state = dict(zip(FIELDS, row))
+        state["page_mode"] = bool(state["page_mode"])
+        return state
+
+    def save(self, path, state):
+        if self.db is None:
+            return False
+        try:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO reading_state(path, part, font, font_size, theme, page_mode, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (os.path.abspath(path), state["part"], state["font"], state["font_size"], state["theme"],
+                     int(state["page_mode"]), time.time()))
+        except sqlite3.Error as e:
+            log.warning("reading state not saved: %s", e)
+            return False
+        self.writes += 1
+        return True
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,73 @@
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QLineEdit, QListWidget, QListWidgetItem, QLabel
+from PySide6.QtCore import Qt, QTimer, Signal
+
+from book_search import snippet
+
+
+class SearchPanel(QWidget):
+    # Поиск по мере ввода в индексе открытой книги; выбор строки — переход к абзацу
+    hit_activated = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.index = None
+        self.texts = []
+
+        layout = QVBoxLayout(self)
+        self.query = QLineEdit()
+        self.query.setPlaceholderText("Search in book")
+        self.query.setClearButtonEnabled(True)
+        layout.addWidget(self.query)
+        self.hits = QListWidget()
+        self.hits.setWordWrap(True)
+        layout.addWidget(self.hits)
+        self.status = QLabel()
+        layout.addWidget(self.status)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.refresh)
+        self.query.textChanged.connect(lambda: self.search_timer.start())
+        self.query.returnPressed.connect(self.activate_first)
+        self.hits.itemActivated.connect(self.activate)
+        self.hits.itemClicked.connect(self.activate)
+
+    def set_book(self, texts):
+        self.texts = texts
+        self.index = None
+        self.hits.clear()
+        self.status.setText("Indexing..." if texts else "")
+
+    def set_progress(self, percent):
+        if self.index is None:
+            self.status.setText(f"Indexing... {percent}%")
+
+    def set_index(self, index):
+        self.index = index
+        self.refresh()
+
+    def refresh(self):
+        self.hits.clear()
+        if self.index is None:
+            return
+        query = self.query.text()
+        found = self.index.search(query)
+        for part in found:
+            item = QListWidgetItem(snippet(self.texts[part], query))
+            item.setData(Qt.UserRole, part)
+            self.hits.addItem(item)
+        self.status.setText(f"{len(found)} matches" if query.strip() else "")
+
+    def activate(self, item):
+        self.hit_activated.emit(item.data(Qt.UserRole), self.query.text())
+
+    def activate_first(self):
+        self.refresh()
+        if self.hits.count():
+            self.hits.setCurrentRow(0)
+            self.activate(self.hits.item(0))
+
+    def focus_query(self):
+        self.query.setFocus()
+        self.query.selectAll()
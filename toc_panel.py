@@ -0,0 +1,57 @@
+from bisect import bisect_right
+
+from PySide6.QtWidgets import QTreeWidget, QTreeWidgetItem
+from PySide6.QtCore import Qt, Signal
+
+
+class TocPanel(QTreeWidget):
+    # Оглавление из вложенных секций модели; у каждого пункта заранее известен
+    # номер первого абзаца, поэтому переход не требует поиска по тексту
+    section_activated = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setHeaderHidden(True)
+        self.setUniformRowHeights(True)
+        self._items = []
+        self._starts = []
+        self.itemActivated.connect(self._activate)
+        self.itemClicked.connect(self._activate)
+
+    def clear(self):
+        super().clear()
+        self._items = []
+        self._starts = []
+
+    def set_document(self, document):
+        self.clear()
+        # Секции в модели идут в порядке документа, родитель всегда раньше ребёнка
+        items = []
+        top = []
+        for section in document.sections:
+            item = QTreeWidgetItem([section.title or "…"])
+            item.setData(0, Qt.UserRole, section.start)
+            if section.parent is None:
+                top.append(item)
+            else:
+                items[section.parent].addChild(item)
+            items.append(item)
+            if section.title:
+                self._items.append(item)
+                self._starts.append(section.start)
+        self.addTopLevelItems(top)
+        if len(items) <= 500:
+            self.expandAll()
+        else:
+            self.expandToDepth(0)
+
+    def _activate(self, item):
+        self.section_activated.emit(item.data(0, Qt.UserRole))
+
+    def follow(self, part):
+        # Подсвечиваем секцию, в которой сейчас читатель
+        i = bisect_right(self._starts, part) - 1
+        if i >= 0 and self.currentItem() is not self._items[i]:
+            self.blockSignals(True)
+            self.setCurrentItem(self._items[i])
+            self.blockSignals(False)